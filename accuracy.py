@@ -1,30 +1,231 @@
+import argparse
+import csv
 import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-for task in ['data/gpt4o_scoring_results.jsonl', 'data/llama_scoring_results.jsonl']:
-    with open(task, 'r') as file:
-        data = [json.loads(line) for line in file]
+import telemetry
+from artifacts import iter_jsonl, loads
+from grading import question_id_lookup, result_score
+from prompts import cache_usage, record_usage
+from retrieval import RETRIEVAL_HITS_PATH
+from squad_dataset import SQUAD_PATH, load_index
 
-    correct_responses = 0
-    total_responses = len(data)
+RESULTS_FILES = {
+    "gpt-4o-mini": "data/gpt4o_scoring_results.jsonl",
+    "llama": "data/llama_scoring_results.jsonl",
+}
+# Generation outputs, whose prompt cache usage is reported alongside each model's accuracy
+GENERATION_FILES = {
+    "gpt-4o-mini": "data/gpt4o_output.json",
+    "llama": "data/llama_output.json",
+}
+REPORT_PATH = "data/accuracy_report"
 
-    for entry in data:
-        # Extract content from response
-        response_content = entry["response"]["body"]["choices"][0]["message"]["content"]
+# Grading custom_ids written before question ids were carried: "<n>. <question>"
+LEGACY_CUSTOM_ID = re.compile(r"^\d+\. (.*)$", re.S)
 
-        try:
-            # Create search for word
-            json_str = response_content[response_content.find('{'):response_content.rfind('}') + 1]
-            score_data = json.loads(json_str)
 
-            # If "score" is true, add 1 to the count
-            if score_data.get("score", False):
-                correct_responses += 1
-        except json.JSONDecodeError:
-            print(f"Error parsing JSON")
+def answer_length_bucket(answers):
+    words = min(len(answer.split()) for answer in answers)
+    if words <= 1:
+        return "1 word"
+    if words <= 3:
+        return "2-3 words"
+    return "4+ words"
 
-    accuracy = (correct_responses / total_responses) * 100
 
-    print(task)
-    print(f"Correct Responses: {correct_responses}")
-    print(f"Total Responses: {total_responses}")
-    print(f"Accuracy: {accuracy:.2f}%\n")
\ No newline at end of file
+def usage_totals():
+    return {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+
+def add_usage(totals, record):
+    prompt_tokens, cached_tokens = record_usage(record)
+    if prompt_tokens:
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_tokens"] += cached_tokens
+
+
+def finish_usage(totals):
+    totals["cache_hit_rate"] = (
+        round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+    )
+    return totals
+
+
+def generation_usage(path):
+    """
+    Stream a generation output file and total its prompt and cached tokens.
+    """
+    if not os.path.exists(path):
+        return cache_usage([])
+    return cache_usage(iter_jsonl(path))
+
+
+def aggregate_file(model, path, squad_path=SQUAD_PATH, hits_path=RETRIEVAL_HITS_PATH, generation_path=None):
+    """
+    Stream one scoring results file and count correct answers overall and per slice.
+
+    Rows are read one at a time and only counters are kept, so memory stays
+    flat however large the file grows. Each row is joined to the dataset by
+    its custom_id (the SQuAD question id) to find its article and gold answer
+    length, and to the retrieval hit log to find whether the gold paragraph
+    was retrieved. Slices that cannot be determined are counted as "unknown".
+
+    Prompt cache usage is totalled for the grader requests in the file and,
+    for its generation requests: those in `generation_path`, or else in the
+    model's known generation output.
+    """
+    index = load_index(squad_path) if os.path.exists(squad_path) else None
+    by_text = None
+    hits = {}
+    if os.path.exists(hits_path):
+        with open(hits_path) as f:
+            hits = json.load(f)
+
+    totals = {"model": model, "path": path, "correct": 0, "total": 0, "parse_errors": 0}
+    breakdown = {"article": {}, "answer_length": {}, "retrieval_hit": {}}
+    grader_usage = usage_totals()
+
+    with open(path, 'rb') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = loads(line)
+            add_usage(grader_usage, entry)
+
+            # Rows the grader failed on (errors, unparsable verdicts) count as incorrect
+            correct = result_score(entry)
+            if correct is None:
+                totals["parse_errors"] += 1
+                correct = False
+
+            question_id = entry["custom_id"]
+            pos = None
+            if index is not None:
+                pos = index.position(question_id)
+                legacy = LEGACY_CUSTOM_ID.match(question_id) if pos is None else None
+                if legacy:
+                    if by_text is None:
+                        by_text = question_id_lookup(index)
+                    question_id = by_text.get(legacy.group(1), question_id)
+                    pos = index.position(question_id)
+
+            if pos is not None:
+                article = index.titles[index.article[index.paragraph[pos]]]
+                length = answer_length_bucket(index.answers[pos]) if index.answers[pos] else "unknown"
+            else:
+                article = length = "unknown"
+            hit = hits.get(question_id)
+            hit = "unknown" if hit is None else ("hit" if hit else "miss")
+
+            totals["total"] += 1
+            totals["correct"] += correct
+            for dimension, key in (("article", article), ("answer_length", length), ("retrieval_hit", hit)):
+                counts = breakdown[dimension].setdefault(key, [0, 0])
+                counts[0] += correct
+                counts[1] += 1
+
+    totals["breakdown"] = breakdown
+    totals["usage"] = {"grading": finish_usage(grader_usage)}
+    generation_path = generation_path or GENERATION_FILES.get(model)
+    if generation_path:
+        totals["usage"]["generation"] = generation_usage(generation_path)
+    return totals
+
+
+def rows_for(result):
+    """
+    Flatten one file's aggregate into report rows.
+    """
+    rows = [{
+        "model": result["model"], "dimension": "overall", "slice": "all",
+        "correct": result["correct"], "total": result["total"],
+    }]
+    for dimension, slices in result["breakdown"].items():
+        for key, (correct, total) in sorted(slices.items()):
+            rows.append({"model": result["model"], "dimension": dimension, "slice": key,
+                         "correct": correct, "total": total})
+    for row in rows:
+        row["accuracy"] = round(row["correct"] / row["total"], 4) if row["total"] else 0.0
+    return rows
+
+
+def write_report(results, report_path=REPORT_PATH, telemetry_summary=None):
+    """
+    Write the aggregates as `<report_path>.json` and a flat `<report_path>.csv`.
+
+    A run telemetry summary (see telemetry.summarize()) is added to the JSON report when given.
+    """
+    rows = [row for result in results for row in rows_for(result)]
+
+    report = {"files": results, "rows": rows}
+    if telemetry_summary is not None:
+        report["telemetry"] = telemetry_summary
+    with open(report_path + ".json", 'w') as f:
+        json.dump(report, f, indent=2)
+
+    with open(report_path + ".csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["model", "dimension", "slice", "correct", "total", "accuracy"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    return rows
+
+
+def print_summary(results):
+    """
+    Print overall accuracy, the answer-length and retrieval-hit slices and prompt cache usage per file.
+    """
+    for result in results:
+        accuracy = (result["correct"] / result["total"]) * 100 if result["total"] else 0.0
+
+        print(result["path"])
+        print(f"Correct Responses: {result['correct']}")
+        print(f"Total Responses: {result['total']}")
+        if result["parse_errors"]:
+            print(f"Unparsable Responses: {result['parse_errors']}")
+        print(f"Accuracy: {accuracy:.2f}%")
+        for dimension in ("answer_length", "retrieval_hit"):
+            slices = ", ".join(
+                f"{key} {correct / total:.1%} ({total})"
+                for key, (correct, total) in sorted(result["breakdown"][dimension].items())
+            )
+            print(f"  by {dimension}: {slices}")
+        for stage, usage in result["usage"].items():
+            if usage["prompt_tokens"]:
+                print(f"  {stage} prompt cache: {usage['cached_tokens']} / {usage['prompt_tokens']} tokens "
+                      f"({usage['cache_hit_rate']:.1%})")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate grading results into accuracy reports.")
+    parser.add_argument("--results", nargs="+", metavar="MODEL=PATH",
+                        help="results files to aggregate (default: the gpt-4o-mini and llama results)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes to aggregate files with")
+    parser.add_argument("--report", default=REPORT_PATH, help="report path prefix for the .json and .csv files")
+    parser.add_argument("--metrics", default=telemetry.METRICS_PATH, help="telemetry file to summarize")
+    parser.add_argument("--run", help="telemetry run id to summarize, or 'all' (default: the latest run)")
+    args = parser.parse_args()
+
+    files = dict(item.split("=", 1) for item in args.results) if args.results else RESULTS_FILES
+    files = {model: path for model, path in files.items() if os.path.exists(path)}
+
+    # Each file is aggregated in its own process
+    with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files)))) as executor:
+        results = list(executor.map(aggregate_file, files.keys(), files.values()))
+
+    print_summary(results)
+
+    usage = telemetry.summarize(telemetry.read_events(args.metrics, args.run))
+    telemetry.print_summary(usage)
+
+    write_report(results, args.report, usage)
+    print(f"Wrote {args.report}.json and {args.report}.csv")
+
+
+if __name__ == "__main__":
+    main()
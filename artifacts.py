@@ -0,0 +1,119 @@
+"""
+Streaming JSONL artifacts: batch inputs, batch outputs and grading results.
+
+Records are written one line at a time and read back lazily, so memory
+stays flat however many questions a run covers. Looking a record up by its
+custom_id goes through an index of byte offsets instead of loading the file.
+"""
+import hashlib
+import itertools
+import json
+import os
+
+# orjson parses lines several times faster when it is installed
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def iter_jsonl(path):
+    """
+    Yield the records of a JSONL file one at a time, skipping blank lines.
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+def write_jsonl(path, records):
+    """
+    Write `records` to `path` one line at a time and swap the file in atomically.
+
+    Returns the number of records written.
+    """
+    count = 0
+    with open(path + ".part", 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    os.replace(path + ".part", path)
+    return count
+
+
+def file_sha256(path):
+    """
+    Hash a file in chunks so large artifacts are never loaded whole.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def chunked(iterable, size):
+    """
+    Yield lists of up to `size` items from any iterable, without materializing it.
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def offset_index(path, key="custom_id"):
+    """
+    Map each record's `key` to the byte offset of its line in a JSONL file.
+    """
+    offsets = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                offsets[loads(line)[key]] = offset
+            offset += len(line)
+    return offsets
+
+
+class JsonlReader:
+    """
+    Random access to the records of a JSONL file by key.
+
+    Only the byte offset of each record is kept in memory; a lookup seeks to
+    the record's line and parses it.
+    """
+
+    def __init__(self, path, key="custom_id"):
+        self.offsets = offset_index(path, key)
+        self._file = open(path, 'rb')
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, key, default=None):
+        offset = self.offsets.get(key)
+        if offset is None:
+            return default
+        self._file.seek(offset)
+        return loads(self._file.readline())
+
+    def line(self, key):
+        """
+        The raw line of the record for `key`, without its newline.
+        """
+        self._file.seek(self.offsets[key])
+        return self._file.readline().rstrip(b'\n').decode("utf-8")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,334 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+from artifacts import JsonlReader, file_sha256, iter_jsonl
+
+# Batch statuses after which the job will never produce output
+FAILED_STATUSES = {"failed", "expired", "cancelled"}
+
+# Per-file limits of the OpenAI batch API
+MAX_REQUESTS_PER_BATCH = 50_000
+MAX_BYTES_PER_BATCH = 200 * 1024 * 1024
+
+
+class BatchFailedError(RuntimeError):
+    """
+    Raised when an OpenAI batch job ends without producing an output file.
+    """
+
+    def __init__(self, batch, errors=None):
+        self.batch = batch
+        self.errors = errors or []
+        details = "; ".join(self.errors[:5])
+        super().__init__(f"Batch {batch.id} ended with status '{batch.status}'" + (f": {details}" if details else ""))
+
+
+def state_path_for(input_path):
+    """
+    Where the job id for a batch input file is persisted between runs.
+    """
+    return input_path + ".batch.json"
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state_path, state):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def submit_batch(client, input_path, state_path=None, endpoint="/v1/chat/completions", completion_window="24h"):
+    """
+    Upload a JSONL input file and create a batch job for it, unless one is already tracked.
+
+    The job id is persisted in `state_path` together with a hash of the input
+    file. If the script is restarted with the same input, the existing job is
+    picked up again instead of being submitted (and paid for) twice.
+
+    Returns the batch id.
+    """
+    state_path = state_path or state_path_for(input_path)
+    input_hash = file_sha256(input_path)
+
+    state = load_state(state_path)
+    if state and state.get("input_sha256") == input_hash:
+        print(f"Resuming tracked batch job {state['batch_id']}")
+        return state["batch_id"]
+
+    # Upload the batch file to OpenAI
+    with open(input_path, 'rb') as f:
+        batch_file = client.files.create(file=f, purpose='batch')
+
+    # Create the batch job
+    batch_job = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=endpoint,
+        completion_window=completion_window
+    )
+    print(f"Submitted batch job {batch_job.id} for {input_path}")
+
+    save_state(state_path, {
+        "batch_id": batch_job.id,
+        "input_file_id": batch_file.id,
+        "input_path": input_path,
+        "input_sha256": input_hash,
+        "submitted_at": time.time(),
+    })
+    return batch_job.id
+
+
+def wait_for_batch(client, batch_id, initial_interval=1.0, max_interval=60.0, backoff=1.5, timeout=None):
+    """
+    Poll a batch job until it reaches a terminal status.
+
+    The polling interval starts at `initial_interval` and grows by `backoff`
+    after every unchanged status, up to `max_interval`. It resets whenever the
+    status or request counts move. Raises BatchFailedError for failed, expired
+    or cancelled jobs, and TimeoutError if `timeout` seconds pass first.
+
+    Returns the completed batch object.
+    """
+    interval = initial_interval
+    started = time.monotonic()
+    last_progress = None
+
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = (batch.status, counts.completed if counts else None, counts.failed if counts else None)
+
+        if progress != last_progress:
+            done = f" ({counts.completed + counts.failed}/{counts.total} requests)" if counts and counts.total else ""
+            print(f'Status ({batch_id}): {batch.status}{done}')
+            last_progress = progress
+            interval = initial_interval
+        else:
+            interval = min(max_interval, interval * backoff)
+
+        if batch.status == "completed":
+            return batch
+        if batch.status in FAILED_STATUSES:
+            raise BatchFailedError(batch, batch_errors(client, batch))
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(f"Batch {batch_id} still '{batch.status}' after {timeout:.0f}s")
+
+        time.sleep(interval)
+
+
+def batch_errors(client, batch):
+    """
+    Collect error messages from a batch's validation errors and its error file.
+    """
+    messages = []
+    if batch.errors and batch.errors.data:
+        messages.extend(f"{e.code}: {e.message}" for e in batch.errors.data)
+    if batch.error_file_id:
+        with client.files.with_streaming_response.content(batch.error_file_id) as response:
+            for line in response.iter_lines():
+                if line.strip():
+                    error = json.loads(line).get("response", {}).get("body", {}).get("error", {})
+                    messages.append(f"{error.get('code')}: {error.get('message')}")
+    return messages
+
+
+def download_file(client, file_id, output_path, chunk_size=1 << 20):
+    """
+    Stream a file's content to disk in chunks, replacing `output_path` atomically.
+    """
+    tmp_path = output_path + ".part"
+    with client.files.with_streaming_response.content(file_id) as response:
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_bytes(chunk_size):
+                f.write(chunk)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def run_batch(client, input_path, output_path, state_path=None, **wait_kwargs):
+    """
+    Submit (or resume) the batch job for `input_path`, wait for it and download its output.
+
+    Requests that failed inside an otherwise completed job are written to
+    `<output_path>.errors.jsonl` and reported. The tracked job state is removed
+    once the output has been downloaded. The wait is recorded as a
+    "batch_wait" telemetry stage.
+    """
+    state_path = state_path or state_path_for(input_path)
+    batch_id = submit_batch(client, input_path, state_path)
+
+    try:
+        with telemetry.timed("batch_wait", batch_id=batch_id):
+            batch = wait_for_batch(client, batch_id, **wait_kwargs)
+    except BatchFailedError:
+        # A dead job cannot be resumed; the next run should submit a fresh one
+        os.remove(state_path)
+        raise
+
+    print("Batch processing completed.")
+
+    if batch.error_file_id:
+        error_path = output_path + ".errors.jsonl"
+        download_file(client, batch.error_file_id, error_path)
+        print(f"{batch.request_counts.failed} requests failed, see {error_path}")
+
+    if batch.output_file_id:
+        download_file(client, batch.output_file_id, output_path)
+    else:
+        open(output_path, 'wb').close()
+
+    os.remove(state_path)
+    return batch
+
+
+def shard_path(path, index):
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index:03d}{ext}"
+
+
+def input_hash_path(output_path):
+    """
+    Where the hash of the input that produced a shard output is kept until the shards are merged.
+    """
+    return output_path + ".input.sha256"
+
+
+def replace_if_changed(tmp_path, path):
+    """
+    Move `tmp_path` over `path` unless `path` already has the same content.
+
+    Returns True if `path` was replaced.
+    """
+    if os.path.exists(path) and file_sha256(path) == file_sha256(tmp_path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+
+def write_shards(tasks, path, max_requests=MAX_REQUESTS_PER_BATCH, max_bytes=MAX_BYTES_PER_BATCH):
+    """
+    Write batch tasks to one or more JSONL files that each fit within the batch API limits.
+
+    A new shard is started whenever the next task would push the current one
+    past `max_requests` lines or `max_bytes` bytes. If everything fits in one
+    shard it is written to `path` itself; otherwise shards are written to
+    `<name>.shard000.jsonl`, `<name>.shard001.jsonl`, ... A file whose
+    content is unchanged since the last run is left untouched.
+
+    Returns the list of file paths written, in task order.
+    """
+    shards = []
+    current = None
+    count = size = 0
+
+    def start_shard():
+        shard = open(shard_path(path, len(shards)) + ".part", 'wb')
+        shards.append(shard)
+        return shard
+
+    try:
+        for task in tasks:
+            line = (json.dumps(task) + '\n').encode("utf-8")
+            if current is None or count >= max_requests or (count and size + len(line) > max_bytes):
+                current = start_shard()
+                count = size = 0
+            current.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        for shard in shards:
+            shard.close()
+
+    if len(shards) <= 1:
+        # A single shard keeps the original artifact name
+        if shards:
+            replace_if_changed(shards[0].name, path)
+        else:
+            open(path, 'wb').close()
+        return [path]
+
+    paths = [shard_path(path, index) for index in range(len(shards))]
+    for shard, shard_input in zip(shards, paths):
+        replace_if_changed(shard.name, shard_input)
+    print(f"Split {path} into {len(paths)} shards")
+    return paths
+
+
+def merge_outputs(input_paths, output_paths, output_path):
+    """
+    Merge shard outputs into one file ordered like the tasks in the shard inputs.
+
+    Batch output lines come back in arbitrary order, so each shard's output
+    is indexed by custom_id (byte offsets only, see artifacts.JsonlReader)
+    and its lines are copied out in that shard's input order.
+    """
+    missing = 0
+    with open(output_path + ".part", 'w') as merged:
+        for input_path, shard_output in zip(input_paths, output_paths):
+            with JsonlReader(shard_output) as results:
+                for task in iter_jsonl(input_path):
+                    if task["custom_id"] in results:
+                        merged.write(results.line(task["custom_id"]) + '\n')
+                    else:
+                        missing += 1
+    os.replace(output_path + ".part", output_path)
+
+    if missing:
+        print(f"{missing} requests have no output line in the merged results")
+
+
+def run_sharded_batch(client, input_paths, output_path, max_workers=4, **wait_kwargs):
+    """
+    Run one batch job per input shard in parallel and merge their outputs into `output_path`.
+
+    A single input file is run directly. Each shard is tracked, polled and
+    downloaded by `run_batch()` in its own thread, and shard outputs are
+    merged back in custom_id order once all of them have completed. If some
+    shards fail, the outputs of the others are kept together with the hash of
+    the input they answer, and a re-run only submits the shards whose input
+    has no output for that exact content.
+    """
+    if len(input_paths) == 1:
+        return [run_batch(client, input_paths[0], output_path, **wait_kwargs)]
+
+    output_paths = [shard_path(output_path, index) for index in range(len(input_paths))]
+
+    def reusable(shard_input, shard_output):
+        if not (os.path.exists(shard_output) and os.path.exists(input_hash_path(shard_output))):
+            return False
+        with open(input_hash_path(shard_output)) as f:
+            return f.read().strip() == file_sha256(shard_input)
+
+    def run_shard(shard_input, shard_output):
+        batch = run_batch(client, shard_input, shard_output, **wait_kwargs)
+        with open(input_hash_path(shard_output), 'w') as f:
+            f.write(file_sha256(shard_input))
+        return batch
+
+    todo = [
+        (shard_input, shard_output) for shard_input, shard_output in zip(input_paths, output_paths)
+        if not reusable(shard_input, shard_output)
+    ]
+    if len(todo) < len(input_paths):
+        print(f"Reusing {len(input_paths) - len(todo)} shard outputs from a previous run")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_shard, shard_input, shard_output) for shard_input, shard_output in todo]
+        batches = [future.result() for future in futures]
+
+    merge_outputs(input_paths, output_paths, output_path)
+    for shard_output in output_paths:
+        os.remove(shard_output)
+        os.remove(input_hash_path(shard_output))
+    print(f"Merged {len(output_paths)} shard outputs into {output_path}")
+    return batches
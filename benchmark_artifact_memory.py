@@ -0,0 +1,157 @@
+"""
+Peak memory of the batch artifact path as the number of questions grows.
+
+Every run answers N synthetic questions through gpt_4o_mini_answers()
+against the local stub server (stub_server.py), then reads the answers back
+and totals the output, in a fresh child process whose peak RSS is reported.
+"streaming" uses the artifact layer as the scripts do; "buffered" holds the
+tasks and the output records in lists, the way the scripts used to, for
+comparison.
+
+    python benchmark_artifact_memory.py --sizes 200 2000 20000
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ARTIFACT_BENCHMARK_PATH = "data/artifact_memory_benchmark.json"
+
+WORDS = ("river", "empire", "council", "harbor", "treaty", "province", "dynasty", "temple", "market", "valley",
+         "garrison", "archive", "plateau", "charter", "monastery", "frontier", "canal", "senate", "forge", "delta")
+
+
+def synthetic_questions(n):
+    for i in range(n):
+        yield {"id": f"synthetic-{i:06d}", "question": f"What did the {WORDS[i % len(WORDS)]} of record {i} decide?"}
+
+
+class SyntheticContexts:
+    """
+    Retrieved contexts made up on demand, so the input itself takes no memory.
+    """
+
+    def __getitem__(self, question):
+        seed = sum(map(ord, question))
+        return [
+            " ".join(WORDS[(seed + chunk * 7 + word) % len(WORDS)] for word in range(110)) + "."
+            for chunk in range(5)
+        ]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(n, mode):
+    """
+    Answer and read back `n` synthetic questions in this process; print the measurements as JSON.
+    """
+    from artifacts import iter_jsonl
+    from gpt_with_context import GPT_INPUT_PATH, generation_tasks, gpt_4o_mini_answers, read_gpt_answers
+    import clients
+    from response_cache import run_cached_batch
+
+    os.makedirs("data", exist_ok=True)
+    output_path = "data/gpt4o_output.json"
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+
+    if mode == "streaming":
+        results = gpt_4o_mini_answers(synthetic_questions(n), SyntheticContexts(), output_path=output_path,
+                                      use_cache=False)
+        output_tokens = sum(r["response"]["body"]["usage"]["completion_tokens"] for r in results)
+        answers = sum(1 for _ in read_gpt_answers(output_path))
+    else:
+        with open(os.devnull, 'w') as stats_file:
+            tasks = list(generation_tasks(synthetic_questions(n), SyntheticContexts(), stats_file))
+        run_cached_batch(clients.openai_client(), tasks, GPT_INPUT_PATH, output_path)
+        results = list(iter_jsonl(output_path))
+        output_tokens = sum(r["response"]["body"]["usage"]["completion_tokens"] for r in results)
+        answers = len(list(read_gpt_answers(output_path)))
+
+    print(json.dumps({
+        "questions": n,
+        "mode": mode,
+        "answers": answers,
+        "output_tokens": output_tokens,
+        "seconds": round(time.perf_counter() - start, 2),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "input_mb": round(os.path.getsize(GPT_INPUT_PATH) / 2 ** 20, 1),
+        "output_mb": round(os.path.getsize(output_path) / 2 ** 20, 1),
+    }))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"stub server did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure peak RSS of the batch artifact path as questions grow.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 20000], help="question counts to run")
+    parser.add_argument("--modes", nargs="+", default=["streaming", "buffered"], choices=["streaming", "buffered"])
+    parser.add_argument("--output", default=ARTIFACT_BENCHMARK_PATH, help="JSON file to write the results to")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="streaming", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child, args.mode)
+        return
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(here, "stub_server.py"), "--port", str(port), "--latency-ms", "0",
+         "--batch-polls", "1"],
+        stdout=subprocess.DEVNULL
+    )
+    env = dict(os.environ, OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1", OPENAI_API_KEY="stub",
+               PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    runs = []
+    try:
+        wait_for_port(port)
+        for mode in args.modes:
+            for n in args.sizes:
+                # Each run gets its own process, so its peak RSS is not inflated by earlier runs
+                with tempfile.TemporaryDirectory() as workdir:
+                    child = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--child", str(n), "--mode", mode],
+                        cwd=workdir, env=env, capture_output=True, text=True, check=True
+                    )
+                run = json.loads(child.stdout.strip().splitlines()[-1])
+                runs.append(run)
+                print(f"{mode:>9} {n:>7} questions: peak RSS {run['peak_rss_mb']:.1f} MB "
+                      f"(+{run['peak_rss_mb'] - run['baseline_rss_mb']:.1f} MB after imports), "
+                      f"{run['input_mb']:.1f} MB in, {run['output_mb']:.1f} MB out, {run['seconds']:.1f}s")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    with open(args.output, 'w') as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": runs}, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
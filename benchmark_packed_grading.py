@@ -0,0 +1,131 @@
+import argparse
+import itertools
+import json
+import os
+import time
+
+import clients
+from grading import artifact_path, grade_answers, result_score
+from providers import PROVIDERS, get_provider
+
+PACKED_GRADING_BENCHMARK_PATH = "data/grading_pack_benchmark.json"
+PACKED_GRADING_BENCHMARK_DIR = "data/grading_pack_benchmark"
+
+
+def grading_usage(rows):
+    """
+    Requests, prompt tokens and completion tokens spent on grading result rows.
+
+    A packed request's usage is carried by its first item, so each request is counted once.
+    """
+    totals = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    for row in rows:
+        usage = ((row.get("response") or {}).get("body") or {}).get("usage")
+        if not usage:
+            continue
+        totals["requests"] += 1
+        totals["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        totals["completion_tokens"] += usage.get("completion_tokens") or 0
+    return totals
+
+
+def run_pack_size(provider, answers, pack_size, output_dir, local_tier=False, use_cache=False):
+    """
+    Grade `answers` with one pack size and return its verdicts, cost and wall time.
+    """
+    results_path = os.path.join(output_dir, f"{provider.name}_pack{pack_size}.jsonl")
+    start = time.perf_counter()
+    grade_answers(answers, f"{provider.label} pack {pack_size}", artifact_path(results_path, "input"), results_path,
+                  local_tier=local_tier, use_cache=use_cache, pack_size=pack_size)
+    seconds = time.perf_counter() - start
+
+    with open(results_path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return {
+        "verdicts": {row["custom_id"]: result_score(row) for row in rows},
+        "usage": grading_usage(rows),
+        "fallbacks": sum(1 for row in rows if "pack" not in row) if pack_size > 1 else 0,
+        "seconds": round(seconds, 3),
+    }
+
+
+def agreement(verdicts, reference):
+    """
+    Share of the questions graded in both runs that received the same verdict.
+    """
+    shared = [qid for qid in reference if qid in verdicts and reference[qid] is not None]
+    if not shared:
+        return 0.0
+    return sum(verdicts[qid] == reference[qid] for qid in shared) / len(shared)
+
+
+def benchmark(provider, answers, pack_sizes, output_dir, local_tier=False, use_cache=False):
+    """
+    Grade the same answers with every pack size and compare each against the smallest.
+    """
+    runs = {size: run_pack_size(provider, answers, size, output_dir, local_tier, use_cache) for size in pack_sizes}
+    reference = runs[min(pack_sizes)]["verdicts"]
+
+    summary = {}
+    for size, run in runs.items():
+        verdicts = run["verdicts"]
+        graded = [score for score in verdicts.values() if score is not None]
+        summary[size] = {
+            **run["usage"],
+            "answers": len(verdicts),
+            "accuracy": round(sum(graded) / len(verdicts), 4) if verdicts else 0.0,
+            "agreement": round(agreement(verdicts, reference), 4),
+            "fallbacks": run["fallbacks"],
+            "failed": len(verdicts) - len(graded),
+            "seconds": run["seconds"],
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare packed grading against single-answer grading: requests, tokens and verdict agreement."
+    )
+    parser.add_argument("--providers", nargs="+", default=list(PROVIDERS), choices=list(PROVIDERS),
+                        help="models whose generated answers are graded")
+    parser.add_argument("--limit", type=int, default=200, help="answers graded per provider")
+    parser.add_argument("--pack-sizes", type=int, nargs="+", default=[1, 5, 10, 20],
+                        help="answers per grader request; the smallest is the reference for agreement")
+    parser.add_argument("--local-tier", action="store_true",
+                        help="pre-score clear cases locally instead of sending every answer to the grader")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="reuse cached grader responses (requests and tokens then only count cache misses)")
+    parser.add_argument("--output", default=PACKED_GRADING_BENCHMARK_PATH, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    os.makedirs(PACKED_GRADING_BENCHMARK_DIR, exist_ok=True)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"limit": args.limit, "pack_sizes": args.pack_sizes, "local_tier": args.local_tier,
+                   "use_cache": args.use_cache},
+        "providers": {},
+    }
+    try:
+        for name in args.providers:
+            provider = get_provider(name)
+            answers = list(itertools.islice(provider.read_answers(), args.limit))
+            summary = benchmark(provider, answers, args.pack_sizes, PACKED_GRADING_BENCHMARK_DIR,
+                                args.local_tier, args.use_cache)
+            report["providers"][name] = summary
+
+            print(f"{name}:")
+            print(f"  {'pack':>4} {'requests':>8} {'prompt tok':>10} {'output tok':>10} "
+                  f"{'accuracy':>8} {'agreement':>9} {'fallbacks':>9} {'seconds':>8}")
+            for size, row in summary.items():
+                print(f"  {size:>4} {row['requests']:>8} {row['prompt_tokens']:>10} {row['completion_tokens']:>10} "
+                      f"{row['accuracy']:>8.1%} {row['agreement']:>9.1%} {row['fallbacks']:>9} {row['seconds']:>8.1f}")
+    finally:
+        clients.close()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import random
+import time
+
+import chromadb
+
+from data_preprocessing import COLLECTION_NAME, context_id, iter_batches
+from embeddings import HashEmbeddingFunction
+from retrieval import retrieve_contexts
+
+WORDS = (
+    "norman france river paris king battle army church century england viking duke "
+    "rollo castle empire trade ship coast city war peace treaty law council bishop "
+    "science energy heat water market bank school music river island mountain"
+).split()
+
+
+class SlowEmbeddingFunction(HashEmbeddingFunction):
+    """
+    Hash embeddings with a fixed delay per call, standing in for an embedding API round-trip.
+    """
+
+    def __init__(self, dim=256, latency=0.0):
+        super().__init__(dim=dim)
+        self.latency = latency
+
+    def __call__(self, input):
+        time.sleep(self.latency)
+        return super().__call__(input)
+
+
+def synthetic_collection(n_contexts, embedding_function, seed=0):
+    """
+    Build an in-memory squad_contexts collection filled with random paragraphs.
+    """
+    rng = random.Random(seed)
+    contexts = [" ".join(rng.choice(WORDS) for _ in range(80)) + f" doc{i}" for i in range(n_contexts)]
+
+    client = chromadb.EphemeralClient()
+    collection = client.get_or_create_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+    for batch in iter_batches(contexts, 256):
+        collection.add(documents=batch, ids=[context_id(c) for c in batch])
+    return collection, contexts
+
+
+def per_question(collection, questions, n_results):
+    """
+    The original retrieval loop: one query call per question.
+    """
+    return {
+        question: collection.query(query_texts=[question], n_results=n_results)["documents"][0]
+        for question in questions
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-question and batched Chroma retrieval.")
+    parser.add_argument("--contexts", type=int, default=2000, help="synthetic paragraphs in the collection")
+    parser.add_argument("--questions", type=int, default=500, help="number of queries")
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=50.0,
+                        help="simulated embedding round-trip per call")
+    args = parser.parse_args()
+
+    ef = SlowEmbeddingFunction(latency=0.0)
+    collection, contexts = synthetic_collection(args.contexts, ef)
+    ef.latency = args.latency_ms / 1000
+
+    rng = random.Random(1)
+    questions = [" ".join(rng.choice(contexts).split()[:12]) + f" q{i}?" for i in range(args.questions)]
+
+    ef.calls = 0
+    start = time.perf_counter()
+    baseline = per_question(collection, questions, args.n_results)
+    per_question_time = time.perf_counter() - start
+    per_question_calls = ef.calls
+
+    ef.calls = 0
+    start = time.perf_counter()
+    batched = retrieve_contexts(collection, questions, n_results=args.n_results, batch_size=args.batch_size)
+    batched_time = time.perf_counter() - start
+    batched_calls = ef.calls
+
+    mismatches = sum(baseline[q] != batched[q] for q in questions)
+
+    print(f"Collection size:  {args.contexts}")
+    print(f"Questions:        {args.questions}")
+    print(f"Per-question:     {per_question_time:.2f}s ({per_question_calls} embedding calls)")
+    print(f"Batched ({args.batch_size:>4}):   {batched_time:.2f}s ({batched_calls} embedding calls)")
+    print(f"Speedup:          {per_question_time / batched_time:.1f}x")
+    print(f"Mismatched results: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from data_preprocessing import context_id, iter_batches
+from embeddings import HashEmbeddingFunction, openai_embedding_function
+from retrieval import open_retriever
+from squad_dataset import SQUAD_PATH, load_index
+
+RETRIEVAL_BENCHMARK_PATH = "data/retrieval_benchmark.json"
+
+
+def gold_questions(path=SQUAD_PATH, limit=500):
+    """
+    The first `limit` answerable questions with the id of their gold paragraph.
+    """
+    index = load_index(path)
+    return [
+        {"id": index.ids[pos], "question": index.questions[pos],
+         "gold_id": context_id(index.contexts[index.paragraph[pos]])}
+        for pos in index.select(answerable_only=True, limit=limit)
+    ]
+
+
+def run_queries(retriever, questions, n_results, batch_size):
+    """
+    Query every question once, `batch_size` at a time.
+
+    Returns (results, batch latencies in seconds, wall time in seconds), with
+    one result per question holding its ranked "ids" and "distances".
+    """
+    results = []
+    latencies = []
+    start = time.perf_counter()
+    for batch in iter_batches(questions, batch_size):
+        batch_start = time.perf_counter()
+        response = retriever.query(query_texts=batch, n_results=n_results)
+        latencies.append(time.perf_counter() - batch_start)
+        for ids, distances in zip(response["ids"], response["distances"]):
+            results.append({"ids": ids, "distances": distances})
+    return results, latencies, time.perf_counter() - start
+
+
+def quality(results, gold_ids, ks):
+    """
+    Recall@k for every k in `ks` and MRR at the deepest k, against the gold paragraph ids.
+    """
+    ranks = []
+    for result, gold_id in zip(results, gold_ids):
+        ranks.append(result["ids"].index(gold_id) + 1 if gold_id in result["ids"] else None)
+
+    metrics = {f"recall@{k}": sum(1 for r in ranks if r is not None and r <= k) / len(ranks) for k in ks}
+    metrics[f"mrr@{max(ks)}"] = sum(1 / r for r in ranks if r is not None) / len(ranks)
+    return metrics, ranks
+
+
+def latency_stats(latencies, n_queries, wall_time):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "batches": len(latencies),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "queries_per_second": n_queries / wall_time if wall_time else 0.0,
+    }
+
+
+def benchmark(retriever, questions, ks=(1, 5, 10), batch_sizes=(1, 16, 64)):
+    """
+    Measure retrieval quality once at the deepest k, then latency and throughput for every (batch size, k).
+
+    Latencies are per query() call, so with batch size B they cover B questions.
+    The quality pass fills the embedding cache, so the timed passes measure
+    search with cached question embeddings rather than embedding API calls.
+    """
+    texts = [q["question"] for q in questions]
+    results, _, _ = run_queries(retriever, texts, max(ks), max(batch_sizes))
+    metrics, ranks = quality(results, [q["gold_id"] for q in questions], ks)
+
+    timings = []
+    for batch_size in batch_sizes:
+        for k in ks:
+            _, latencies, wall_time = run_queries(retriever, texts, k, batch_size)
+            timings.append({"batch_size": batch_size, "k": k, **latency_stats(latencies, len(texts), wall_time)})
+            print(f"  batch {batch_size:>4}, k {k:>3}: {timings[-1]['queries_per_second']:.0f} q/s, "
+                  f"p50 {timings[-1]['p50_ms']:.2f} ms, p99 {timings[-1]['p99_ms']:.2f} ms")
+
+    per_question = [
+        {"id": q["id"], "gold_id": q["gold_id"], "gold_rank": rank,
+         "ids": result["ids"], "distances": result["distances"]}
+        for q, result, rank in zip(questions, results, ranks)
+    ]
+    return {"quality": metrics, "latency": timings, "questions": per_question}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency against SQuAD gold paragraphs.")
+    parser.add_argument("--backends", nargs="+", default=["chroma"], choices=["chroma", "numpy", "bm25", "hybrid"])
+    parser.add_argument("--data", default=SQUAD_PATH, help="SQuAD json file with the questions")
+    parser.add_argument("--limit", type=int, default=500, help="answerable questions to run")
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 5, 10], help="k values for recall and timing")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="embed questions with the offline hash embedding function")
+    parser.add_argument("--output", default=RETRIEVAL_BENCHMARK_PATH, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    questions = gold_questions(args.data, args.limit)
+    ef = HashEmbeddingFunction() if args.fake_embeddings else openai_embedding_function()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"data": args.data, "questions": len(questions), "ks": args.ks, "batch_sizes": args.batch_sizes},
+        "backends": {},
+    }
+    for backend in args.backends:
+        print(f"{backend}:")
+        result = benchmark(open_retriever(backend, embedding_function=ef), questions, args.ks, args.batch_sizes)
+        report["backends"][backend] = result
+        print("  " + ", ".join(f"{name} {value:.3f}" for name, value in result["quality"].items()))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
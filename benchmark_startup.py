@@ -0,0 +1,85 @@
+"""
+Import time of every module, each measured in a fresh interpreter.
+
+Importing a module should only define things: heavy dependencies (Chroma,
+the OpenAI and Azure SDKs) and clients load on first use, and scripts only
+run under `__main__`. This tracks how long each import takes and which heavy
+dependencies it pulls in, so a regression shows up as a number.
+
+    python benchmark_startup.py
+    python benchmark_startup.py --modules gpt_with_context llama_with_context --repeats 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+STARTUP_BENCHMARK_PATH = "data/startup_benchmark.json"
+
+MODULES = ("clients", "prompts", "telemetry", "artifacts", "squad_dataset", "context_packing", "response_cache",
+           "data_preprocessing", "embeddings", "retrieval", "bm25", "vector_index", "grading", "gpt_with_context",
+           "llama_with_context", "providers", "accuracy", "pipeline", "evaluation_matrix")
+# Dependencies slow enough to import that only code using them should load them
+HEAVY_DEPENDENCIES = ("chromadb", "openai", "azure.core", "azure.ai.inference", "numpy", "tiktoken")
+
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(module, here):
+    """
+    Seconds taken to import `module` in a new interpreter, and the heavy dependencies it loaded.
+    """
+    child = subprocess.run(
+        [sys.executable, "-c", CHILD.format(module=module, heavy=HEAVY_DEPENDENCIES)],
+        cwd=here, capture_output=True, text=True, check=True
+    )
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def benchmark(modules, repeats, here):
+    results = {}
+    for module in modules:
+        runs = [time_import(module, here) for _ in range(repeats)]
+        seconds = [run["seconds"] for run in runs]
+        results[module] = {
+            "median_seconds": round(statistics.median(seconds), 4),
+            "min_seconds": round(min(seconds), 4),
+            "loaded": runs[-1]["loaded"],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of each module in a fresh interpreter.")
+    parser.add_argument("--modules", nargs="+", default=list(MODULES), help="modules to import")
+    parser.add_argument("--repeats", type=int, default=5, help="fresh imports per module; the median is reported")
+    parser.add_argument("--output", default=STARTUP_BENCHMARK_PATH, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = benchmark(args.modules, args.repeats, here)
+
+    width = max(len("module"), *map(len, results))
+    print(f"{'module':<{width}} {'median s':>9} {'min s':>7}  heavy dependencies loaded")
+    for module, result in results.items():
+        print(f"{module:<{width}} {result['median_seconds']:>9.3f} {result['min_seconds']:>7.3f}  "
+              f"{', '.join(result['loaded']) or '-'}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                   "repeats": args.repeats, "modules": results}, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmark_retrieval import synthetic_collection
+from embeddings import HashEmbeddingFunction
+from vector_index import VectorIndex, export_from_chroma
+
+
+def timed_queries(index, embeddings, n_results, batch_size):
+    """
+    Run every query embedding through `index` and return (result ids, queries per second).
+    """
+    ids = []
+    start = time.perf_counter()
+    for i in range(0, len(embeddings), batch_size):
+        ids.extend(index.query(query_embeddings=embeddings[i:i + batch_size], n_results=n_results)["ids"])
+    elapsed = time.perf_counter() - start
+    return ids, len(embeddings) / elapsed
+
+
+def recall(results, truth):
+    """
+    Mean fraction of the true top-k ids found in each result list.
+    """
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall and QPS of the NumPy vector index against Chroma.")
+    parser.add_argument("--contexts", type=int, default=20000, help="synthetic paragraphs in the collection")
+    parser.add_argument("--questions", type=int, default=1000, help="number of queries")
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--ivf-lists", type=int, default=64, help="IVF lists for the partitioned index")
+    parser.add_argument("--n-probe", type=int, default=8, help="IVF lists searched per query")
+    args = parser.parse_args()
+
+    ef = HashEmbeddingFunction()
+    collection, contexts = synthetic_collection(args.contexts, ef)
+
+    rng = random.Random(1)
+    questions = [" ".join(rng.choice(contexts).split()[:12]) + f" q{i}?" for i in range(args.questions)]
+    # Embed once up front so only search time is measured
+    embeddings = np.asarray(ef(questions), dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as flat_path, tempfile.TemporaryDirectory() as ivf_path:
+        start = time.perf_counter()
+        export_from_chroma(collection, flat_path)
+        export_time = time.perf_counter() - start
+        export_from_chroma(collection, ivf_path, n_lists=args.ivf_lists)
+
+        flat = VectorIndex(flat_path)
+        ivf = VectorIndex(ivf_path, n_probe=args.n_probe)
+
+        # Exact search is the ground truth for recall
+        truth, flat_qps = timed_queries(flat, embeddings, args.n_results, args.batch_size)
+        chroma_ids, chroma_qps = timed_queries(collection, embeddings.tolist(), args.n_results, args.batch_size)
+        ivf_ids, ivf_qps = timed_queries(ivf, embeddings, args.n_results, args.batch_size)
+
+    k = args.n_results
+    print(f"Collection size:  {args.contexts}")
+    print(f"Questions:        {args.questions}")
+    print(f"Export:           {export_time:.2f}s")
+    print(f"{'backend':<24}{'recall@' + str(k):>10}{'QPS':>12}")
+    print(f"{'chroma (hnsw)':<24}{recall(chroma_ids, truth):>10.3f}{chroma_qps:>12.0f}")
+    print(f"{'numpy exact':<24}{1.0:>10.3f}{flat_qps:>12.0f}")
+    print(f"{f'numpy ivf {args.n_probe}/{args.ivf_lists}':<24}{recall(ivf_ids, truth):>10.3f}{ivf_qps:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import argparse
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+
+import numpy as np
+
+from data_preprocessing import context_id, iter_batches, iter_paragraphs
+from squad_dataset import SQUAD_PATH, file_fingerprint, load_index
+
+BM25_PATH = "data/bm25_index.npz"
+
+# Bump when the saved layout changes so stale indexes are rebuilt
+BM25_VERSION = 1
+
+TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from had has have in is it its of on or that the their this "
+    "to was were what when where which who whom why with how".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def pack_strings(strings):
+    """
+    Encode strings as one UTF-8 byte array plus an array of end offsets.
+    """
+    encoded = [s.encode("utf-8") for s in strings]
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    ends = np.cumsum([len(e) for e in encoded], dtype=np.int64)
+    return blob, ends
+
+
+def unpack_strings(blob, ends):
+    data = blob.tobytes()
+    starts = [0] + ends[:-1].tolist()
+    return [data[s:e].decode("utf-8") for s, e in zip(starts, ends.tolist())]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of documents, with array-backed postings.
+
+    Postings are stored in CSR form: the postings of term t are
+    `doc_rows[offsets[t]:offsets[t + 1]]` with matching entries in
+    `frequencies`. Scoring a query touches only the postings of its terms and
+    accumulates into one float64 score per document. Terms are scored in
+    query order and ties are broken by document row, so a query always ranks
+    the same way whatever the process's hash seed.
+
+    `query()` takes and returns the same shapes as a Chroma collection's.
+    Distances are negated BM25 scores, so smaller is still better.
+    """
+
+    def __init__(self, ids, documents, terms, offsets, doc_rows, frequencies, lengths, k1=1.5, b=0.75):
+        self.ids = ids
+        self.documents = documents
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_rows = doc_rows
+        self.frequencies = frequencies
+        self.lengths = lengths
+
+        n_docs = len(ids)
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_length = float(lengths.mean()) if n_docs else 0.0
+        self.k1 = k1
+        # Per-document part of the BM25 denominator, computed once
+        self.length_norm = (k1 * (1 - b + b * lengths / (avg_length or 1.0))).astype(np.float32)
+
+    def count(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_documents(cls, ids, documents, **kwargs):
+        terms = {}
+        term_rows, doc_rows, frequencies = [], [], []
+        lengths = np.zeros(len(documents), dtype=np.int32)
+        for row, document in enumerate(documents):
+            tokens = tokenize(document)
+            lengths[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_rows.append(terms.setdefault(term, len(terms)))
+                doc_rows.append(row)
+                frequencies.append(tf)
+
+        term_rows = np.array(term_rows, dtype=np.int32)
+        order = np.argsort(term_rows, kind="stable")
+        offsets = np.searchsorted(term_rows[order], np.arange(len(terms) + 1)).astype(np.int64)
+        return cls(
+            list(ids), list(documents), list(terms), offsets,
+            np.array(doc_rows, dtype=np.int32)[order],
+            np.minimum(np.array(frequencies, dtype=np.int64)[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            lengths, **kwargs
+        )
+
+    @classmethod
+    def from_squad(cls, path=SQUAD_PATH, **kwargs):
+        """
+        Index the distinct SQuAD paragraphs, with the same ids preprocessing() stores in Chroma.
+        """
+        documents = list(dict.fromkeys(iter_paragraphs(path)))
+        return cls.from_documents([context_id(d) for d in documents], documents, **kwargs)
+
+    def save(self, path=BM25_PATH, source=None):
+        """
+        Write the index as one compressed .npz; `source` is stored to detect staleness.
+        """
+        terms = sorted(self.terms, key=self.terms.get)
+        arrays = {}
+        for name, strings in (("ids", self.ids), ("documents", self.documents), ("terms", terms)):
+            arrays[name + "_blob"], arrays[name + "_ends"] = pack_strings(strings)
+        meta = {"version": BM25_VERSION, "source": source}
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f, meta=np.array(json.dumps(meta)), offsets=self.offsets, doc_rows=self.doc_rows,
+                frequencies=self.frequencies, lengths=self.lengths, **arrays
+            )
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_meta(path=BM25_PATH):
+        with np.load(path) as data:
+            return json.loads(str(data["meta"]))
+
+    @classmethod
+    def load(cls, path=BM25_PATH, **kwargs):
+        with np.load(path) as data:
+            strings = {name: unpack_strings(data[name + "_blob"], data[name + "_ends"])
+                       for name in ("ids", "documents", "terms")}
+            return cls(
+                strings["ids"], strings["documents"], strings["terms"], data["offsets"],
+                data["doc_rows"], data["frequencies"], data["lengths"], **kwargs
+            )
+
+    def search(self, text, n_results=10):
+        """
+        The rows and scores of the `n_results` best matching documents, best first.
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float64)
+        # Each distinct term once, in query order (iterating a set would depend on the hash seed)
+        for term in dict.fromkeys(tokenize(text)):
+            t = self.terms.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            rows = self.doc_rows[start:end]
+            tf = self.frequencies[start:end].astype(np.float64)
+            scores[rows] += self.idf[t] * tf * (self.k1 + 1) / (tf + self.length_norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > n_results:
+            # Keep every document tied with the n-th best score, so the tie-break below decides
+            kth = scores[matched[np.argpartition(-scores[matched], n_results - 1)[n_results - 1]]]
+            matched = matched[scores[matched] >= kth]
+        # Best score first, then lowest row
+        matched = matched[np.lexsort((matched, -scores[matched]))][:n_results]
+        return matched, scores[matched]
+
+    def query(self, query_texts, n_results=10, include=None):
+        results = {"ids": [], "documents": [], "distances": []}
+        for text in query_texts:
+            rows, scores = self.search(text, n_results)
+            results["ids"].append([self.ids[i] for i in rows])
+            results["documents"].append([self.documents[i] for i in rows])
+            results["distances"].append([-float(s) for s in scores])
+        return results
+
+
+def load_bm25(squad_path=SQUAD_PATH, path=BM25_PATH):
+    """
+    Load the BM25 index for `squad_path`, building and saving it if missing or stale.
+    """
+    source = {"path": squad_path, **file_fingerprint(squad_path)}
+    if os.path.exists(path):
+        try:
+            meta = BM25Index.read_meta(path)
+            if meta.get("version") == BM25_VERSION and meta.get("source") == source:
+                return BM25Index.load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    start = time.perf_counter()
+    index = BM25Index.from_squad(squad_path)
+    index.save(path, source=source)
+    print(f"Built BM25 index over {index.count()} paragraphs in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse ranked lists of (id, document) pairs; each list adds 1 / (k + rank) to an id's score.
+
+    Returns (id, document, score) tuples, best first.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, (doc_id, document) in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+            documents[doc_id] = document
+    return [(doc_id, documents[doc_id], score)
+            for doc_id, score in sorted(scores.items(), key=lambda item: -item[1])]
+
+
+class HybridRetriever:
+    """
+    Dense and BM25 retrieval combined with reciprocal rank fusion.
+
+    Each retriever returns its top `candidates` for every query and the fused
+    top `n_results` are kept. Both retrievers must use the same document ids,
+    which holds for the Chroma collection and BM25Index.from_squad().
+    """
+
+    def __init__(self, dense, lexical, candidates=50, k=60):
+        self.dense = dense
+        self.lexical = lexical
+        self.candidates = candidates
+        self.k = k
+
+    def query(self, query_texts, n_results=10, include=None):
+        query_texts = list(query_texts)
+        n_candidates = max(n_results, self.candidates)
+        dense = self.dense.query(query_texts=query_texts, n_results=n_candidates)
+        lexical = self.lexical.query(query_texts=query_texts, n_results=n_candidates)
+
+        results = {"ids": [], "documents": [], "distances": []}
+        for i in range(len(query_texts)):
+            fused = reciprocal_rank_fusion([
+                zip(dense["ids"][i], dense["documents"][i]),
+                zip(lexical["ids"][i], lexical["documents"][i]),
+            ], k=self.k)[:n_results]
+            results["ids"].append([doc_id for doc_id, _, _ in fused])
+            results["documents"].append([document for _, document, _ in fused])
+            results["distances"].append([-score for _, _, score in fused])
+        return results
+
+
+def evaluate(retriever, questions, gold_contexts, n_results=5, batch_size=64):
+    """
+    Gold-paragraph recall@n_results and per-query latency of a retriever.
+    """
+    hits = 0
+    latencies = []
+    for batch in iter_batches(list(zip(questions, gold_contexts)), batch_size):
+        start = time.perf_counter()
+        results = retriever.query(query_texts=[q for q, _ in batch], n_results=n_results)
+        latencies.extend([(time.perf_counter() - start) / len(batch)] * len(batch))
+        hits += sum(gold in documents for (_, gold), documents in zip(batch, results["documents"]))
+
+    latencies.sort()
+    return {
+        "questions": len(questions),
+        f"recall@{n_results}": hits / len(questions) if questions else 0.0,
+        "mean_ms": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+        "p95_ms": 1000 * latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    from retrieval import open_retriever
+
+    parser = argparse.ArgumentParser(description="Build the BM25 index and measure gold-paragraph recall.")
+    parser.add_argument("--data", default=SQUAD_PATH, help="SQuAD json file to index")
+    parser.add_argument("--output", default=BM25_PATH, help="where to save the index")
+    parser.add_argument("--modes", nargs="+", default=["bm25"], choices=["bm25", "hybrid", "chroma"],
+                        help="retrievers to evaluate; hybrid and chroma need the embedding API")
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=500, help="answerable questions to evaluate")
+    args = parser.parse_args()
+
+    index = load_bm25(args.data, args.output)
+    squad = load_index(args.data)
+    positions = squad.select(answerable_only=True, limit=args.limit)
+    questions = [squad.questions[pos] for pos in positions]
+    gold = [squad.contexts[squad.paragraph[pos]] for pos in positions]
+
+    for mode in args.modes:
+        if mode == "bm25":
+            retriever = index
+        elif mode == "hybrid":
+            retriever = HybridRetriever(open_retriever("chroma"), index)
+        else:
+            retriever = open_retriever(mode)
+        report = evaluate(retriever, questions, gold, n_results=args.n_results)
+        print(f"{mode:>7}: recall@{args.n_results} {report[f'recall@{args.n_results}']:.3f}, "
+              f"{report['mean_ms']:.2f} ms/query (p95 {report['p95_ms']:.2f} ms) "
+              f"over {report['questions']} questions")
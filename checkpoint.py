@@ -0,0 +1,87 @@
+import json
+import os
+
+
+def record_key(record):
+    """
+    Key identifying which question an output record answers.
+
+    Records carry the SQuAD question id; older records without one fall back
+    to the question text.
+    """
+    return record.get("id") or record.get("question")
+
+
+def load_completed(path, key=record_key):
+    """
+    Index the records already written to a JSONL checkpoint file.
+
+    A trailing line that is incomplete or not valid JSON (left behind by a
+    crash mid-write) is truncated away so appending can continue safely.
+    Unparsable lines elsewhere in the file are skipped and reported.
+
+    Returns a dict mapping `key(record)` to the record.
+    """
+    completed = {}
+    if not os.path.exists(path):
+        return completed
+
+    good_end = 0
+    bad_lines = 0
+    skipped = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError("incomplete line")
+                if line.strip():
+                    record = json.loads(line)
+                    completed[key(record)] = record
+            except ValueError:
+                bad_lines += 1
+                continue
+            good_end = f.tell()
+            skipped = bad_lines
+
+    # Only a damaged tail can be cut off without losing good records after it
+    if good_end < os.path.getsize(path):
+        with open(path, 'r+b') as f:
+            f.truncate(good_end)
+        print(f"Truncated a partial record at the end of {path}")
+    if skipped:
+        print(f"Skipped {skipped} unreadable lines in {path}")
+
+    return completed
+
+
+def append_record(output_file, record):
+    """
+    Append one record as a single line and push it to disk immediately.
+    """
+    output_file.write(json.dumps(record) + '\n')
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+
+def rewrite_in_order(path, keys, key=record_key):
+    """
+    Atomically rewrite a checkpoint file with one record per key, in `keys` order.
+
+    `key` maps a record to the key it is ordered and deduplicated by.
+
+    Duplicates are dropped and records for keys not listed are kept at the
+    end. The new file is written next to the old one and swapped in with
+    os.replace, so readers never see a half-written file.
+    """
+    completed = load_completed(path, key=key)
+    ordered = [completed.pop(k) for k in dict.fromkeys(keys) if k in completed]
+    ordered.extend(completed.values())
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        for record in ordered:
+            f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(ordered)
@@ -0,0 +1,130 @@
+"""
+API and database clients shared by every stage, created on first use.
+
+Nothing is constructed at import time. Each synchronous client is built
+once per process and reused, so its HTTP connection pool is shared by
+every caller instead of every script opening its own.
+"""
+import os
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_clients = {}
+# Reentrant, since building one client may ask for others (the retriever needs the embedding function)
+_lock = threading.RLock()
+
+
+def shared(name, factory):
+    """
+    The client registered under `name`, built with `factory()` the first time it is asked for.
+    """
+    with _lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def openai_client():
+    def build():
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return shared("openai", build)
+
+
+def azure_chat_client():
+    def build():
+        from azure.ai.inference import ChatCompletionsClient
+        from azure.core.credentials import AzureKeyCredential
+        return ChatCompletionsClient(
+            endpoint=os.environ["AZURE_MLSTUDIO_ENDPOINT"],
+            credential=AzureKeyCredential(os.environ["AZURE_MLSTUDIO_KEY"]),
+        )
+    return shared("azure_chat", build)
+
+
+def async_azure_chat_client():
+    """
+    A new async Azure chat client; the caller closes it.
+
+    Async clients are bound to the event loop they are used on, so these are
+    not shared. Retries are left to throttling.call_with_retry, so the SDK's
+    own retry policy is disabled.
+    """
+    from azure.ai.inference.aio import ChatCompletionsClient
+    from azure.core.credentials import AzureKeyCredential
+    return ChatCompletionsClient(
+        endpoint=os.environ["AZURE_MLSTUDIO_ENDPOINT"],
+        credential=AzureKeyCredential(os.environ["AZURE_MLSTUDIO_KEY"]),
+        retry_total=0,
+    )
+
+
+def chroma_client(path=None):
+    from data_preprocessing import CHROMA_PATH
+    path = path or CHROMA_PATH
+
+    def build():
+        import chromadb
+        return chromadb.PersistentClient(path=path)
+    return shared(f"chroma:{path}", build)
+
+
+def embedding_function():
+    """
+    The cached OpenAI embedding function; question embeddings are shared across stages.
+    """
+    def build():
+        from embeddings import openai_embedding_function
+        return openai_embedding_function()
+    return shared("embedding_function", build)
+
+
+def query_embedding_function(backend=None):
+    """
+    The shared embedding function if `backend` embeds its queries, or None for BM25, which never needs one.
+    """
+    from retrieval import RETRIEVER_BACKEND
+    if (backend or RETRIEVER_BACKEND) == "bm25":
+        return None
+    return embedding_function()
+
+
+def response_cache():
+    """
+    The persistent response cache shared by generation and grading.
+    """
+    def build():
+        from response_cache import ResponseCache
+        return ResponseCache()
+    return shared("response_cache", build)
+
+
+def retriever(backend=None, squad_path=None):
+    """
+    The retriever for `backend` and the SQuAD file at `squad_path` (see retrieval.open_retriever()), opened once.
+    """
+    from retrieval import RETRIEVER_BACKEND, open_retriever
+    from squad_dataset import SQUAD_PATH
+    backend = backend or RETRIEVER_BACKEND
+    squad_path = squad_path or SQUAD_PATH
+
+    def build():
+        if backend == "bm25":
+            return open_retriever(backend, squad_path=squad_path)
+        return open_retriever(backend, embedding_function=embedding_function(), client=chroma_client(),
+                              squad_path=squad_path)
+    return shared(f"retriever:{backend}:{squad_path}", build)
+
+
+def close():
+    """
+    Close every client opened so far.
+    """
+    with _lock:
+        for client in _clients.values():
+            if hasattr(client, "close"):
+                client.close()
+        _clients.clear()
@@ -0,0 +1,233 @@
+import json
+import re
+
+from prompts import generation_messages
+
+# No budget by default: every distinct retrieved chunk is kept, as before packing existed
+DEFAULT_CONTEXT_TOKENS = None
+DEFAULT_ENCODING = "o200k_base"
+
+WORDS = re.compile(r"\w+")
+APPROX_TOKENS = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "for", "by", "with", "from", "and", "or", "is", "are",
+    "was", "were", "be", "been", "did", "do", "does", "what", "which", "who", "whom", "whose", "when",
+    "where", "why", "how", "that", "this", "these", "those", "it", "its", "as", "into", "than", "then",
+}
+
+
+class TokenCounter:
+    """
+    Count tokens locally with tiktoken, or approximate them when it is unavailable.
+
+    The approximation counts words and punctuation marks, which tracks BPE
+    token counts closely enough for budgeting English prose.
+    """
+
+    def __init__(self, encoding_name=DEFAULT_ENCODING):
+        self.encoding = None
+        # tiktoken gives exact counts for OpenAI models; without it token counts are approximated.
+        # It is imported here, on first use, so importing this module stays cheap.
+        try:
+            import tiktoken
+        except ImportError:
+            return
+        try:
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            # The encoding file could not be loaded (e.g. no network); approximate instead
+            self.encoding = None
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(APPROX_TOKENS.findall(text))
+
+    def truncate(self, text, max_tokens):
+        """
+        The longest prefix of `text` within `max_tokens` tokens.
+        """
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+        if max_tokens <= 0:
+            return ""
+        ends = [match.end() for match in APPROX_TOKENS.finditer(text)]
+        return text[:ends[max_tokens - 1]] if max_tokens < len(ends) else text
+
+    def count_messages(self, *texts):
+        # Chat formatting adds a few tokens per message on top of its content
+        return sum(self.count(text) + 4 for text in texts)
+
+
+def question_terms(question):
+    return {word for word in WORDS.findall(question.lower()) if word not in STOPWORDS}
+
+
+def shingles(text, size=5):
+    words = WORDS.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def deduplicate(chunks, threshold=0.8):
+    """
+    Drop chunks that repeat or largely overlap an earlier (more relevant) chunk.
+
+    Two chunks overlap when at least `threshold` of the smaller one's 5-word
+    shingles also appear in the other. Returns (kept chunks, number dropped).
+    """
+    kept = []
+    kept_shingles = []
+    for chunk in chunks:
+        chunk_shingles = shingles(chunk)
+        duplicate = any(
+            len(chunk_shingles & other) >= threshold * min(len(chunk_shingles), len(other))
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(chunk)
+            kept_shingles.append(chunk_shingles)
+    return kept, len(chunks) - len(kept)
+
+
+def trim_to_question(chunk, terms, window=1):
+    """
+    Keep only the sentences of a chunk that mention a question term, plus `window` sentences around each.
+
+    Chunks with no matching sentence are returned unchanged.
+    """
+    sentences = SENTENCE_END.split(chunk)
+    matches = [i for i, sentence in enumerate(sentences) if terms & set(WORDS.findall(sentence.lower()))]
+    if not matches:
+        return chunk
+
+    keep = set()
+    for i in matches:
+        keep.update(range(max(0, i - window), min(len(sentences), i + window + 1)))
+    return " ".join(sentences[i] for i in sorted(keep))
+
+
+def fit_sentences(chunk, max_tokens, counter):
+    """
+    The longest prefix of whole sentences of `chunk` within `max_tokens`, or "" if none fit.
+    """
+    kept = []
+    used = 0
+    for sentence in SENTENCE_END.split(chunk):
+        tokens = counter.count(sentence) + 1
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return " ".join(kept)
+
+
+def pack_context(question, chunks, max_tokens=DEFAULT_CONTEXT_TOKENS, trim=False, counter=None, separator="\n\n"):
+    """
+    Build the context for a prompt from retrieved chunks within a token budget.
+
+    Chunks are taken in relevance (retrieval) order after near-duplicates are
+    removed. With `trim`, each chunk is first cut down to the sentences around
+    the question's terms. With a `max_tokens` budget, the first chunk that no
+    longer fits whole is cut at a sentence boundary to fill the remaining
+    budget, and packing stops there. The most relevant chunk is always kept:
+    if not even its first sentence fits, it is cut to the budget mid-sentence.
+    `max_tokens` None packs every chunk.
+
+    Returns (context, stats) where stats records the chunk and token counts.
+    """
+    counter = counter or TokenCounter()
+    unique, duplicates = deduplicate(chunks)
+    terms = question_terms(question)
+    separator_tokens = counter.count(separator)
+
+    packed = []
+    used = 0
+    trimmed = 0
+    for chunk in unique:
+        if trim:
+            shorter = trim_to_question(chunk, terms)
+            trimmed += shorter != chunk
+            chunk = shorter
+
+        cost = counter.count(chunk) + (separator_tokens if packed else 0)
+        if max_tokens is None or used + cost <= max_tokens:
+            packed.append(chunk)
+            used += cost
+            continue
+
+        remaining = max_tokens - used - (separator_tokens if packed else 0)
+        partial = fit_sentences(chunk, remaining, counter) if remaining > 0 else ""
+        if not packed and not partial:
+            partial = counter.truncate(chunk, max(remaining, 1))
+        if partial:
+            packed.append(partial)
+            used += counter.count(partial) + (separator_tokens if len(packed) > 1 else 0)
+            trimmed += 1
+        break
+
+    context = separator.join(packed)
+    stats = {
+        "chunks_retrieved": len(chunks),
+        "duplicates_dropped": duplicates,
+        "chunks_packed": len(packed),
+        "chunks_trimmed": trimmed,
+        "context_tokens": counter.count(context),
+        "unpacked_context_tokens": counter.count(separator.join(chunks)),
+    }
+    return context, stats
+
+
+def packed_prompts(questions, retrieved, context_tokens=DEFAULT_CONTEXT_TOKENS, trim_context=False,
+                   variant="default"):
+    """
+    Yield (item, messages, stats) for each question item, in order.
+
+    The question's retrieved chunks are packed into the context budget
+    (see pack_context()) and formatted into the generation prompt of
+    `variant`. `stats` holds the question id, the packing statistics and the
+    prompt size counted locally.
+    """
+    counter = TokenCounter()
+    for item in questions:
+        question = item["question"]
+
+        # Pack the chunks into the context token budget, most relevant first
+        context, stats = pack_context(question, retrieved[question], max_tokens=context_tokens,
+                                      trim=trim_context, counter=counter)
+
+        # Static instructions come first so every request shares a cacheable prefix
+        messages = generation_messages(context, question, variant)
+        stats["prompt_tokens"] = counter.count_messages(*(m["content"] for m in messages))
+        yield item, messages, {"id": item["id"], **stats}
+
+
+def write_prompt_stats(path, rows, mode='w'):
+    """
+    Write one JSON line of prompt statistics per request.
+    """
+    with open(path, mode) as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+
+
+def print_prompt_stats(rows):
+    """
+    Print the total prompt and context tokens of a run, and the context tokens packing saved.
+
+    `rows` may be any iterable of stats rows; it is read once.
+    """
+    requests = prompt = context = unpacked = duplicates = 0
+    for row in rows:
+        requests += 1
+        prompt += row["prompt_tokens"]
+        context += row["context_tokens"]
+        unpacked += row["unpacked_context_tokens"]
+        duplicates += row["duplicates_dropped"]
+    if not requests:
+        return
+    print(f"Prompt tokens: {prompt} over {requests} requests ({prompt / requests:.0f} per request)")
+    print(f"Context tokens: {context} packed from {unpacked} retrieved "
+          f"({1 - context / unpacked if unpacked else 0:.1%} saved, {duplicates} duplicate chunks dropped)")
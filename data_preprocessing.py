@@ -1,46 +1,165 @@
-import json
-import chromadb
-from chromadb.utils import embedding_functions
-from dotenv import load_dotenv
-import os
+import argparse
+import hashlib
 
-# Load environment variables (for OpenAI API key)
-load_dotenv()
+from squad_dataset import SQUAD_PATH, load_index
 
-def preprocessing():
-    with open("data/dev-v2.0.json", 'r') as f:
-        data = json.load(f)
+CHROMA_PATH = "data/my_chromadb"
+COLLECTION_NAME = "squad_contexts"
 
-    # Establish client
-    chroma_client = chromadb.PersistentClient(path="data/my_chromadb")
 
-    openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model_name="text-embedding-3-small"
-    )
+def context_id(context):
+    """
+    Stable id for a context chunk, derived from a hash of its text.
+
+    The same paragraph always maps to the same id, so re-running ingestion can
+    tell which paragraphs are already stored.
+    """
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()[:32]
+
+
+def iter_paragraphs(path=SQUAD_PATH):
+    """
+    Yield every paragraph context in a SQuAD file, in file order.
+    """
+    yield from load_index(path).contexts
+
+
+def iter_batches(items, batch_size):
+    """
+    Group an iterable into lists of at most `batch_size` items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_collection(embedding_function=None, path=CHROMA_PATH, client=None):
+    """
+    Open (or create) the squad_contexts collection.
+    """
+    if client is None:
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+    if embedding_function is None:
+        from embeddings import openai_embedding_function
+        embedding_function = openai_embedding_function()
 
-    # create a collection named squad_contexts, with a provided embedding function
-    collection = chroma_client.get_or_create_collection(
-        name="squad_contexts",
-        embedding_function=openai_ef
+    return client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=embedding_function
     )
 
-    # Initialize counter for unique ids
-    id_counter = 0
-
-    # Extract context chunks and store in Chroma
-    for article in data["data"]:
-        for paragraph in article["paragraphs"]:
-            context = paragraph["context"]
-            context_id = str(id_counter)
-            collection.add(
-                documents=[context],
-                ids=[context_id]
-            )
-            # Increment the counter
-            id_counter += 1
-            print(f"Successfully added {id_counter}")
-
-    print(f"Successfully stored {id_counter} context chunks in the Chroma database.")
-
-preprocessing()
\ No newline at end of file
+
+def stale_ids(collection, keep=None, page_size=5000):
+    """
+    Yield the stale ids stored in `collection`, a page at a time.
+
+    Ids from the old ingestion scheme, a running paragraph counter, are
+    always stale. With `keep`, so is every id not in it.
+    """
+    offset = 0
+    while True:
+        ids = collection.get(include=[], limit=page_size, offset=offset)["ids"]
+        if not ids:
+            return
+        yield from (chunk_id for chunk_id in ids
+                    if chunk_id.isdigit() or (keep is not None and chunk_id not in keep))
+        offset += len(ids)
+
+
+def preprocessing(path=SQUAD_PATH, collection=None, batch_size=128, prune=False):
+    """
+    Embed and store SQuAD paragraphs in the squad_contexts collection.
+
+    Paragraphs are streamed from the dataset and written in batches of
+    `batch_size`, so each batch costs a single embedding request and a single
+    Chroma write. Paragraphs whose content-hash id is already in the collection
+    are skipped, so a re-run only embeds new or changed text.
+
+    Rows written under the old numeric ids duplicate the hashed ones, so they
+    are removed afterwards. With `prune`, every other chunk that is not a
+    paragraph of this dataset is removed too; leave it off when several
+    datasets share the collection.
+
+    Returns a dict with the number of paragraphs seen, added, skipped and removed.
+    """
+    if collection is None:
+        collection = get_collection()
+
+    seen = set()
+    stats = {"seen": 0, "added": 0, "skipped": 0, "removed": 0}
+
+    for batch in iter_batches(iter_paragraphs(path), batch_size):
+        # Drop paragraphs repeated within this run
+        ids, documents = [], []
+        for context in batch:
+            stats["seen"] += 1
+            chunk_id = context_id(context)
+            if chunk_id in seen:
+                stats["skipped"] += 1
+                continue
+            seen.add(chunk_id)
+            ids.append(chunk_id)
+            documents.append(context)
+
+        if not ids:
+            continue
+
+        # Drop paragraphs stored by a previous run
+        existing = set(collection.get(ids=ids, include=[])["ids"])
+        new_ids = [chunk_id for chunk_id in ids if chunk_id not in existing]
+        new_documents = [doc for chunk_id, doc in zip(ids, documents) if chunk_id not in existing]
+        stats["skipped"] += len(ids) - len(new_ids)
+
+        if new_ids:
+            collection.add(documents=new_documents, ids=new_ids)
+            stats["added"] += len(new_ids)
+
+        print(f"Processed {stats['seen']} paragraphs ({stats['added']} added)")
+
+    # Collect first, so deleting does not shift the pages still being read
+    for stale in list(iter_batches(stale_ids(collection, seen if prune else None), batch_size * 40)):
+        collection.delete(ids=stale)
+        stats["removed"] += len(stale)
+
+    print(f"Successfully stored {stats['added']} new context chunks in the Chroma database "
+          f"({stats['skipped']} already present, {stats['removed']} stale removed).")
+    return stats
+
+
+if __name__ == "__main__":
+    # Loading the embeddings module also loads the OpenAI API key from .env
+    from embeddings import CachedEmbeddingFunction, HashEmbeddingFunction, openai_embedding_function
+
+    parser = argparse.ArgumentParser(description="Embed SQuAD contexts into Chroma.")
+    parser.add_argument("--data", default=SQUAD_PATH, help="SQuAD json file to ingest")
+    parser.add_argument("--chroma-path", default=CHROMA_PATH, help="Chroma persistence directory")
+    parser.add_argument("--batch-size", type=int, default=128, help="paragraphs per embedding request")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="use the offline hash embedding function instead of OpenAI")
+    parser.add_argument("--no-embedding-cache", action="store_true",
+                        help="always call the embedding API instead of reusing cached vectors")
+    parser.add_argument("--prune", action="store_true",
+                        help="remove stored chunks that are not paragraphs of this dataset, e.g. of other datasets")
+    args = parser.parse_args()
+
+    if args.fake_embeddings:
+        ef = HashEmbeddingFunction()
+    elif args.no_embedding_cache:
+        ef = openai_embedding_function(cache_path=None)
+    else:
+        ef = openai_embedding_function()
+
+    preprocessing(
+        path=args.data,
+        collection=get_collection(embedding_function=ef, path=args.chroma_path),
+        batch_size=args.batch_size,
+        prune=args.prune
+    )
+    if isinstance(ef, CachedEmbeddingFunction):
+        ef.print_stats()
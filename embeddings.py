@@ -0,0 +1,158 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+from chromadb.utils import embedding_functions
+from dotenv import load_dotenv
+
+import telemetry
+from sqlite_cache import LRUStore
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_PATH = "data/embedding_cache.sqlite"
+
+
+def openai_embedding_function(model_name=EMBEDDING_MODEL, cache_path=EMBEDDING_CACHE_PATH):
+    """
+    Build the OpenAI embedding function used for the squad_contexts collection.
+
+    Unless `cache_path` is None, the function is wrapped in a
+    CachedEmbeddingFunction so identical texts are only embedded once across
+    ingestion, retrieval and re-runs.
+    """
+    openai_ef = embedding_functions.OpenAIEmbeddingFunction(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model_name=model_name
+    )
+    if cache_path is None:
+        return openai_ef
+    return CachedEmbeddingFunction(openai_ef, model_name=model_name, path=cache_path)
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function wrapper backed by a persistent SQLite cache.
+
+    Vectors are stored as float32 blobs keyed by a hash of (model_name, text).
+    Only texts missing from the cache are passed to the wrapped function, in
+    a single call, whose latency and estimated tokens are recorded as an
+    "embed" request. When the cache grows past `max_entries`, the least
+    recently used rows are evicted (see sqlite_cache.LRUStore).
+    """
+
+    def __init__(self, embedding_function, model_name=EMBEDDING_MODEL,
+                 path=EMBEDDING_CACHE_PATH, max_entries=500_000):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.path = path
+        self.store = LRUStore(path, "vectors", max_entries)
+        self._lock = threading.Lock()
+        self._counter = None
+        self._migrate()
+
+    def _migrate(self):
+        # Caches written before the shared store kept their vectors in an "embeddings" table
+        if self.store.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'embeddings'"):
+            self.store.execute(
+                "INSERT OR IGNORE INTO vectors (key, value, size, last_used) "
+                "SELECT key, vector, LENGTH(vector), last_used FROM embeddings"
+            )
+            self.store.execute("DROP TABLE embeddings")
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def __call__(self, input):
+        keys = [self._key(text) for text in input]
+
+        # One call at a time, so concurrent callers never embed the same missing text twice
+        with self._lock:
+            cached = {key: np.frombuffer(blob, dtype=np.float32) for key, blob in self.store.get_many(keys).items()}
+
+            # Embed the texts that were not cached, each distinct text once
+            missing = {}
+            for key, text in zip(keys, input):
+                if key not in cached and key not in missing:
+                    missing[key] = text
+            if missing:
+                start = time.perf_counter()
+                vectors = self.embedding_function(list(missing.values()))
+                self._record_request(missing.values(), time.perf_counter() - start)
+                for key, vector in zip(missing, vectors):
+                    cached[key] = np.asarray(vector, dtype=np.float32)
+                self.store.put_many((key, cached[key].tobytes()) for key in missing)
+
+        return [cached[key] for key in keys]
+
+    def _record_request(self, texts, latency):
+        # The embeddings API reports no usage through Chroma, so tokens are counted locally
+        if self._counter is None:
+            from context_packing import TokenCounter
+            self._counter = TokenCounter("cl100k_base")
+        tokens = sum(self._counter.count(text) for text in texts)
+        telemetry.record_request("embed", self.model_name, {"prompt_tokens": tokens}, latency, texts=len(texts))
+
+    def stats(self):
+        """
+        Return hit/miss counters for this process and the number of cached vectors.
+        """
+        return self.store.stats()
+
+    def print_stats(self):
+        self.store.print_stats("Embedding cache", "vectors")
+
+    # Report the wrapped function's identity so Chroma's persisted collection
+    # config keeps matching the underlying embedding model.
+    def name(self):
+        return self.embedding_function.name()
+
+    def get_config(self):
+        return self.embedding_function.get_config()
+
+    @staticmethod
+    def build_from_config(config):
+        return embedding_functions.OpenAIEmbeddingFunction.build_from_config(config)
+
+
+class HashEmbeddingFunction(EmbeddingFunction):
+    """
+    Deterministic, offline embedding function for tests and benchmarks.
+
+    Each lowercase word is hashed into one of `dim` buckets and the resulting
+    count vector is L2-normalized, so texts sharing words land close together
+    without any network call.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.calls = 0
+
+    def __call__(self, input):
+        self.calls += 1
+        embeddings = []
+        for text in input:
+            vector = [0.0] * self.dim
+            for word in re.findall(r"\w+", text.lower()):
+                bucket = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % self.dim
+                vector[bucket] += 1.0
+            norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+            embeddings.append([v / norm for v in vector])
+        return embeddings
+
+    @staticmethod
+    def name():
+        return "squad_hash"
+
+    def get_config(self):
+        return {"dim": self.dim}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction(dim=config.get("dim", 256))
@@ -0,0 +1,216 @@
+"""
+Evaluate several (provider, model, prompt variant) configurations side by side.
+
+Retrieval runs once and is shared; every configuration then generates its
+answers concurrently from the same contexts, all answers are graded in one
+combined batch, and a single comparison table is printed and written to
+data/matrix_report.{json,csv}.
+
+    python evaluation_matrix.py --configs gpt gpt::concise llama
+    python evaluation_matrix.py --configs gpt:gpt-4o-mini gpt:gpt-4o --limit 200
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import clients
+import telemetry
+from accuracy import aggregate_file
+from artifacts import iter_jsonl
+from context_packing import DEFAULT_CONTEXT_TOKENS
+from grading import GRADING_PACK_SIZE, grade_answer_sets
+from pipeline import Pipeline
+from prompts import GENERATION_VARIANTS
+from providers import get_provider
+from retrieval import RETRIEVER_BACKEND
+from squad_dataset import SQUAD_PATH
+
+MATRIX_DIR = "data/matrix"
+MATRIX_REPORT_PATH = "data/matrix_report"
+MATRIX_COLUMNS = ["label", "provider", "model", "variant", "accuracy", "correct", "total", "hit_accuracy",
+                  "miss_accuracy", "generation_seconds", "prompt_tokens", "completion_tokens", "cost"]
+
+
+def parse_config(spec):
+    """
+    A provider configured from "provider[:model[:variant]]"; empty parts keep the provider's defaults.
+    """
+    name, model, variant = (spec.split(":") + ["", ""])[:3]
+    provider = get_provider(name)
+    if variant and variant not in GENERATION_VARIANTS:
+        raise ValueError(f"Unknown prompt variant {variant!r}; choose from {', '.join(GENERATION_VARIANTS)}")
+    label = re.sub(r"[^A-Za-z0-9.-]+", "-", "_".join(part for part in (name, model, variant) if part))
+    return provider.configure(model=model or None, variant=variant or None, label=label, directory=MATRIX_DIR)
+
+
+def generation_cost(model, path):
+    """
+    Prompt tokens, completion tokens and USD cost of the generation requests in an output file.
+
+    Answers served from the response cache cost nothing. The cost is None
+    when `model` has no known price.
+    """
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+    if not os.path.exists(path):
+        return totals
+    for record in iter_jsonl(path):
+        if record.get("from_cache"):
+            continue
+        if isinstance(record.get("response"), dict):
+            # Batch output line
+            prompt_tokens, cached_tokens, completion_tokens = telemetry.usage_counts(
+                record["response"].get("body", {}).get("usage"))
+            batch = True
+        else:
+            prompt_tokens, cached_tokens = record.get("input_tokens") or 0, record.get("cached_tokens") or 0
+            completion_tokens = record.get("output_tokens") or 0
+            batch = False
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        usd = telemetry.cost(model, prompt_tokens, completion_tokens, cached_tokens, batch)
+        totals["cost"] = None if usd is None or totals["cost"] is None else totals["cost"] + usd
+    if totals["cost"] is not None:
+        totals["cost"] = round(totals["cost"], 6)
+    return totals
+
+
+def generate_all(providers, questions, contexts, max_workers=None, **options):
+    """
+    Generate answers for every configuration at once, one thread each.
+
+    Returns the wall time of each configuration's generation by label.
+    """
+    def generate(provider):
+        start = time.perf_counter()
+        with telemetry.timed(f"generate:{provider.label}"):
+            provider.generate(questions, contexts, resume=False, **options)
+        seconds = time.perf_counter() - start
+        print(f"[{provider.label}] generated in {seconds:.1f}s")
+        return seconds
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(providers)) as executor:
+        return dict(zip([p.label for p in providers], executor.map(generate, providers)))
+
+
+def slice_accuracy(result, dimension, key):
+    correct, total = result["breakdown"][dimension].get(key, (0, 0))
+    return round(correct / total, 4) if total else None
+
+
+def comparison_rows(providers, seconds, squad_path=SQUAD_PATH):
+    rows = []
+    for provider in providers:
+        result = aggregate_file(provider.model, provider.results_path, squad_path=squad_path,
+                                generation_path=provider.output_path)
+        rows.append({
+            "label": provider.label,
+            "provider": provider.name,
+            "model": provider.model,
+            "variant": provider.variant,
+            "accuracy": round(result["correct"] / result["total"], 4) if result["total"] else 0.0,
+            "correct": result["correct"],
+            "total": result["total"],
+            "hit_accuracy": slice_accuracy(result, "retrieval_hit", "hit"),
+            "miss_accuracy": slice_accuracy(result, "retrieval_hit", "miss"),
+            "generation_seconds": round(seconds[provider.label], 3),
+            **generation_cost(provider.model, provider.output_path),
+        })
+    return rows
+
+
+def print_table(rows):
+    def percent(value):
+        return f"{value:.1%}" if value is not None else "-"
+
+    width = max(len("config"), *(len(row["label"]) for row in rows))
+    print(f"{'config':<{width}} {'accuracy':>8} {'correct':>9} {'hit':>6} {'miss':>6} "
+          f"{'gen s':>7} {'prompt tok':>10} {'output tok':>10} {'cost $':>9}")
+    for row in sorted(rows, key=lambda row: row["accuracy"], reverse=True):
+        cost = f"{row['cost']:.4f}" if row["cost"] is not None else "-"
+        print(f"{row['label']:<{width}} {row['accuracy']:>8.1%} {row['correct']:>4}/{row['total']:<4} "
+              f"{percent(row['hit_accuracy']):>6} {percent(row['miss_accuracy']):>6} "
+              f"{row['generation_seconds']:>7.1f} {row['prompt_tokens']:>10} {row['completion_tokens']:>10} {cost:>9}")
+
+
+def write_matrix_report(rows, config, report_path=MATRIX_REPORT_PATH):
+    with open(report_path + ".json", 'w') as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": config, "rows": rows}, f, indent=2)
+    with open(report_path + ".csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=MATRIX_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare provider/model/prompt configurations on shared retrieval with one grading batch."
+    )
+    parser.add_argument("--configs", nargs="+", required=True,
+                        help="configurations as provider[:model[:variant]], e.g. gpt gpt::concise llama")
+    parser.add_argument("--data", default=SQUAD_PATH, help="SQuAD json file")
+    parser.add_argument("--limit", type=int, default=500, help="answerable questions to answer")
+    parser.add_argument("--backend", default=RETRIEVER_BACKEND, choices=["chroma", "numpy", "bm25", "hybrid"],
+                        help="retriever backend")
+    parser.add_argument("--n-results", type=int, default=5, help="chunks retrieved per question")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="token budget for the retrieved context in each prompt "
+                             "(default: no budget, every distinct retrieved chunk is kept)")
+    parser.add_argument("--trim-context", action="store_true",
+                        help="trim chunks to the sentences around the question terms")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum Llama requests in flight per config")
+    parser.add_argument("--rps", type=float, default=10.0, help="maximum Llama requests started per second per config")
+    parser.add_argument("--grading-pack-size", type=int, default=GRADING_PACK_SIZE,
+                        help="answers graded per grader request (1 grades each answer on its own)")
+    parser.add_argument("--no-local-tier", action="store_true",
+                        help="send every answer to the LLM grader instead of pre-scoring clear cases locally")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="send every generation and grading request instead of reusing cached responses")
+    parser.add_argument("--force", action="store_true", help="re-run ingestion and retrieval even if up to date")
+    parser.add_argument("--output", default=MATRIX_REPORT_PATH, help="report path, without extension")
+    args = parser.parse_args()
+
+    providers = [parse_config(spec) for spec in args.configs]
+    labels = [provider.label for provider in providers]
+    if len(set(labels)) != len(labels):
+        parser.error("each configuration must be distinct")
+    os.makedirs(MATRIX_DIR, exist_ok=True)
+
+    # Ingestion and retrieval are the pipeline's own stages, skipped when up to date
+    pipeline = Pipeline([], data_path=args.data, limit=args.limit, backend=args.backend, n_results=args.n_results,
+                        force=args.force)
+    use_cache = not args.no_response_cache
+    try:
+        pipeline.run(["ingest", "retrieve"])
+        questions, contexts = pipeline.load_retrieved()
+
+        seconds = generate_all(providers, questions, contexts, context_tokens=args.context_tokens,
+                               trim_context=args.trim_context, use_cache=use_cache,
+                               concurrency=args.concurrency, requests_per_second=args.rps)
+
+        with telemetry.timed("score"):
+            grade_answer_sets(
+                {p.label: (p.read_answers(), p.results_path) for p in providers},
+                os.path.join(MATRIX_DIR, "scoring_input_batch.jsonl"),
+                os.path.join(MATRIX_DIR, "scoring_results.jsonl"),
+                local_tier=not args.no_local_tier, use_cache=use_cache, pack_size=args.grading_pack_size,
+                squad_path=args.data
+            )
+
+        rows = comparison_rows(providers, seconds, args.data)
+    finally:
+        clients.close()
+
+    print_table(rows)
+    config = {"configs": args.configs, "limit": args.limit, "backend": args.backend, "n_results": args.n_results,
+              "context_tokens": args.context_tokens, "trim_context": args.trim_context,
+              "local_tier": not args.no_local_tier, "pack_size": args.grading_pack_size}
+    write_matrix_report(rows, config, args.output)
+    print(f"Wrote {args.output}.json and {args.output}.csv")
+
+
+if __name__ == "__main__":
+    main()
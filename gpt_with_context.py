@@ -1,138 +1,112 @@
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+import argparse
 import json
-import time
-import chromadb
-from chromadb.utils import embedding_functions
 
-load_dotenv('.env')
-
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-chroma_client = chromadb.PersistentClient(path="data/my_chromadb")
-
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model_name="text-embedding-3-small"
-)
-
-collection = chroma_client.get_collection(
-    name="squad_contexts",
-    embedding_function=openai_ef
-)
-
-# System and user prompts
-system_prompt = "You are a smart AI model. Answer this question correctly and keep it as short and concise as possible, prioritizing answering questions correctly."
-user_prompt = """You are a smart AI assistant that answers questions using data returned by a search engine.
-
-Guidelines:
-\t1. You will be provided with a question by the user, you must answer that question, and nothing else.
-\t2. Your answer should come directly from the provided context from the search engine.
-\t3. Do not make up any information not provided in the context.
-\t4. If the provided question does not contain the answers, respond with 'I am sorry, but I am unable to answer that question.'
-\t5. Be aware that some chunks in the context may be irrelevant, incomplete, and/or poorly formatted.
-
-Here is the provided context:
-{context}
-
-Here is the question: {question}
-
-Your response: """
-
-"""
-Retrieve top 5 semantically similar context chunks given a question
-"""
-def retrieve_context(idx, question, n_results=5):
-    print(f"Retrieving most relevant contexts for the question: {idx}")
-
-    results = collection.query(query_texts=[question], n_results=n_results)
-    return results["documents"][0]
-
-def possible_questions():
-    with open("data/dev-v2.0.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    valid_responses = []
-    for article in data["data"]:
-        for paragraph in article["paragraphs"]:
-            for qa in paragraph["qas"]:
-                if not qa["is_impossible"]:
-                    valid_responses.append(qa["question"])
-                if len(valid_responses) >= 500:
-                    return valid_responses
-
-def gpt_4o_mini_answers(questions):
-    tasks = []
-    for idx, question in enumerate(questions):
-        context_chunks = retrieve_context(idx, question, n_results=5)
-        context = "\n\n".join(context_chunks)
-
-        formatted_user_prompt = user_prompt.format(context=context, question=question)
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": formatted_user_prompt}
-        ]
-
-        task = {
-            "custom_id": f"question={question}",
+import clients
+import telemetry
+from artifacts import iter_jsonl
+from context_packing import DEFAULT_CONTEXT_TOKENS, packed_prompts, print_prompt_stats
+from prompts import print_cache_usage
+from response_cache import run_cached_batch
+from retrieval import retrieve_for_questions
+from squad_dataset import possible_questions
+
+GPT_INPUT_PATH = "data/gpt4o_input_batch.jsonl"
+GPT_OUTPUT_PATH = "data/gpt4o_output.json"
+GPT_PROMPT_STATS_PATH = "data/gpt4o_prompt_stats.jsonl"
+GPT_MODEL = "gpt-4o-mini"
+
+def generation_tasks(questions, retrieved, stats_file, context_tokens=DEFAULT_CONTEXT_TOKENS, trim_context=False,
+                     model=GPT_MODEL, variant="default"):
+    """
+    Yield one batch task per question, writing its prompt statistics to `stats_file` as it goes.
+
+    `variant` selects the generation system prompt (see prompts.GENERATION_VARIANTS).
+    """
+    for item, messages, stats in packed_prompts(questions, retrieved, context_tokens, trim_context, variant):
+        stats_file.write(json.dumps(stats) + '\n')
+
+        # custom_id carries the SQuAD question id so scoring can join on it
+        yield {
+            "custom_id": item["id"],
             "method": "POST",
             "url": "/v1/chat/completions",
             "body": {
-                "model": "gpt-4o-mini",
+                "model": model,
                 "temperature": 0.2,
                 "messages": messages
             }
         }
-        tasks.append(task)
-
-    # Write tasks to JSON file for batch processing
-    with open("data/gpt4o_input_batch.jsonl", 'w') as jf:
-        for task in tasks:
-            jf.write(json.dumps(task) + '\n')
-
-    # Upload the batch file to OpenAI
-    batch_file = openai_client.files.create(
-        file=open("data/gpt4o_input_batch.jsonl", 'rb'),
-        purpose='batch'
-    )
-
-    # Run the batch job
-    batch_job = openai_client.batches.create(
-        input_file_id=batch_file.id,
-        endpoint="/v1/chat/completions",
-        completion_window="24h"
-    )
-
-    # Wait for the batch job to complete
-    complete = False
-    while not complete:
-        check = openai_client.batches.retrieve(batch_job.id)
-        print(f'Status: {check.status}')
-        if check.status == 'completed':
-            complete = True
-        time.sleep(1)
-
-    print("Batch processing complete.")
-
-    result = openai_client.files.content(check.output_file_id).content
-    answered_questions = "data/gpt4o_output.json"
-    with open(answered_questions, 'wb') as file:
-        file.write(result)
-
-    res = []
-    with open(answered_questions, 'r') as file:
-        for line in file:
-            json_object = json.loads(line.strip())
-            res.append(json_object)
-
-    return res
-
-valid_questions = possible_questions()
-results = gpt_4o_mini_answers(valid_questions)
 
-# Print the model's responses
-for item in results:
-    print("Model's Response:")
-    print('\t', item['response']['body']['choices'][0]['message']['content'])
\ No newline at end of file
+def gpt_4o_mini_answers(questions, retrieved=None, client=None, context_tokens=DEFAULT_CONTEXT_TOKENS,
+                        trim_context=False, output_path=GPT_OUTPUT_PATH, use_cache=True, model=GPT_MODEL,
+                        variant="default", input_path=GPT_INPUT_PATH, stats_path=GPT_PROMPT_STATS_PATH):
+    """
+    Answer questions with gpt-4o-mini through the OpenAI batch API.
+
+    `retrieved` maps each question to its context chunks; when omitted the
+    top 5 chunks are retrieved with the shared retriever. With `use_cache`,
+    requests identical to earlier ones are answered from the response cache
+    and only the rest are submitted. `model` and the prompt `variant` can be
+    swapped to compare configurations; give each its own `output_path`,
+    `input_path` and `stats_path` when several run at once.
+
+    `questions` may be any iterable: tasks are built one at a time and
+    streamed to the batch input file, so memory does not grow with the
+    number of questions. Returns an iterator over the batch output records,
+    which are written to `output_path`.
+    """
+    if retrieved is None:
+        # Retrieve top 5 semantically similar context chunks for every question at once
+        questions = list(questions)
+        retrieved = retrieve_for_questions(clients.retriever(), questions, n_results=5,
+                                           embedding_function=clients.query_embedding_function())
+
+    # Submit the uncached tasks as sharded batch jobs (or resume tracked ones) and merge the outputs,
+    # recording the locally counted prompt size of every request on the way
+    cache = clients.response_cache().scoped(output_path) if use_cache else None
+    with open(stats_path, 'w') as stats_file:
+        tasks = generation_tasks(questions, retrieved, stats_file, context_tokens, trim_context, model, variant)
+        run_cached_batch(client or clients.openai_client(), tasks, input_path, output_path, cache)
+    print_prompt_stats(iter_jsonl(stats_path))
+    if cache is not None:
+        cache.print_stats("gpt4o response cache")
+
+    print_cache_usage(iter_jsonl(output_path), "gpt4o")
+    telemetry.record_batch_results("generate", iter_jsonl(output_path))
+    return iter_jsonl(output_path)
+
+def read_gpt_answers(path=GPT_OUTPUT_PATH):
+    """
+    Yield the answers in a gpt-4o-mini batch output file, as dicts with "id", "question" and "response".
+    """
+    # Extract questions and GPT's responses, keyed by the SQuAD id carried in custom_id
+    for entry in iter_jsonl(path):
+        custom_id = entry["custom_id"]
+        response_content = entry["response"]["body"]["choices"][0]["message"]["content"]
+        if custom_id.startswith("question="):
+            # Outputs from before ids were carried only have the question text
+            answer = {"question": custom_id.replace("question=", "", 1)}
+        else:
+            answer = {"id": custom_id, "question": None}
+        answer["response"] = response_content
+        yield answer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer SQuAD questions with gpt-4o-mini using retrieved context.")
+    parser.add_argument("--limit", type=int, default=500, help="answerable questions to answer")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="token budget for the retrieved context in each prompt "
+                             "(default: no budget, every distinct retrieved chunk is kept)")
+    parser.add_argument("--trim-context", action="store_true",
+                        help="trim chunks to the sentences around the question terms")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="send every request instead of reusing cached responses")
+    args = parser.parse_args()
+
+    results = gpt_4o_mini_answers(possible_questions(args.limit), context_tokens=args.context_tokens,
+                                  trim_context=args.trim_context, use_cache=not args.no_response_cache)
+
+    # Print the model's responses
+    for item in results:
+        print("Model's Response:")
+        print('\t', item['response']['body']['choices'][0]['message']['content'])
\ No newline at end of file
@@ -0,0 +1,510 @@
+import json
+import os
+
+import clients
+import telemetry
+from artifacts import JsonlReader, iter_jsonl, write_jsonl
+from local_scoring import local_verdicts
+from prompts import (GRADING_RESPONSE_FORMAT, PACKED_GRADING_RESPONSE_FORMAT, grading_messages,
+                     packed_grading_messages, print_cache_usage)
+from response_cache import run_cached_batch, task_key
+from squad_dataset import SQUAD_PATH, load_index
+
+# {"score": false} is 5 tokens; the cap only leaves headroom, so a runaway response fails fast
+GRADING_MAX_TOKENS = 16
+# Re-graded rows get more room in case the first attempt was cut off
+REGRADE_MAX_TOKENS = 64
+# Answers graded per request in packed mode; 1 grades every answer in its own request
+GRADING_PACK_SIZE = 1
+# Packed verdicts cost about 10 tokens each ({"id":"12","score":false},)
+PACKED_TOKENS_PER_ITEM = 12
+
+# The exact grader outputs structured output produces, resolved without a JSON parse
+SCORE_LITERALS = {
+    '{"score":true}': True, '{"score":false}': False,
+    '{"score": true}': True, '{"score": false}': False,
+}
+
+
+def question_id_lookup(index):
+    """
+    Map question text to SQuAD id, for output records written before ids were stored.
+
+    When a question text appears more than once, the first answerable
+    occurrence wins, matching the order the generators asked them in.
+    """
+    lookup = {}
+    for pos in index.select(answerable_only=True):
+        lookup.setdefault(index.questions[pos], index.ids[pos])
+    return lookup
+
+
+def join_answers(index, answers, question_ids=None):
+    """
+    Join model answers to their gold questions by SQuAD question id.
+
+    `answers` is an iterable of dicts with "question" and "response" keys and
+    an "id" key when the generator recorded one. Records without an id are
+    resolved through their question text. The join is a hash lookup, so the
+    answers may be any subset of the dataset, in any order. If
+    `question_ids` is given, only those questions are kept.
+
+    Returns (matched, unmatched): matched is a list of (question record,
+    answer) pairs for answerable questions, and unmatched lists the answers
+    that could not be joined, each with a "reason".
+    """
+    wanted = set(question_ids) if question_ids is not None else None
+    by_text = None
+    matched = []
+    unmatched = []
+    seen = set()
+
+    for answer in answers:
+        question_id = answer.get("id")
+        if question_id is None:
+            if by_text is None:
+                by_text = question_id_lookup(index)
+            question_id = by_text.get(answer.get("question"))
+
+        pos = index.position(question_id) if question_id is not None else None
+        if pos is None:
+            unmatched.append(dict(answer, reason="unknown question"))
+            continue
+        if wanted is not None and question_id not in wanted:
+            continue
+        if question_id in seen:
+            unmatched.append(dict(answer, reason="duplicate answer"))
+            continue
+        seen.add(question_id)
+
+        qa = index.record(pos)
+        if not qa["answers"]:
+            unmatched.append(dict(answer, reason="no gold answer"))
+            continue
+        matched.append((qa, dict(answer, id=question_id)))
+
+    return matched, unmatched
+
+
+def report_join(matched, unmatched, name):
+    """
+    Print how many answers were joined and why the rest were not.
+    """
+    print(f"{name}: {len(matched)} answers matched to gold questions")
+    if unmatched:
+        reasons = {}
+        for answer in unmatched:
+            reasons[answer["reason"]] = reasons.get(answer["reason"], 0) + 1
+        summary = ", ".join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+        print(f"{name}: {len(unmatched)} answers not graded ({summary})")
+        for answer in unmatched[:5]:
+            print(f"\t{answer['reason']}: {answer.get('id') or answer.get('question')}")
+
+
+def parse_score(content):
+    """
+    The grader's boolean verdict from a response's content.
+
+    Raises ValueError unless the content is a JSON object with a boolean
+    "score"; text around the JSON, or a score like "true" or 1, is rejected.
+    """
+    content = content.strip()
+    if content in SCORE_LITERALS:
+        return SCORE_LITERALS[content]
+    data = json.loads(content)
+    if not isinstance(data, dict) or not isinstance(data.get("score"), bool):
+        raise ValueError(f"grader response has no boolean score: {content[:80]!r}")
+    return data["score"]
+
+
+def result_score(result):
+    """
+    The verdict of one grading result line, or None when the row failed.
+
+    A row fails when its request errored or its content does not parse
+    (see parse_score()), e.g. because it was cut off by the token cap.
+    """
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    try:
+        return parse_score(response["body"]["choices"][0]["message"]["content"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def local_result(question_id, score, explanation):
+    """
+    A grading result decided locally, in the same shape as a batch output line.
+    """
+    content = json.dumps({"score": score, "explanation": explanation})
+    return {
+        "id": f"local-{question_id}",
+        "custom_id": question_id,
+        "response": {
+            "status_code": 200,
+            "request_id": None,
+            "body": {
+                "model": "local",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }]
+            }
+        },
+        "error": None
+    }
+
+
+def pre_score(matched, name, reject_f1=None):
+    """
+    Grade the clear-cut answers locally and return the rest for the LLM grader.
+
+    Answers that exactly match or contain a gold answer are marked correct and
+    refusals are marked incorrect; see local_scoring.local_verdicts() for
+    `reject_f1`.
+
+    Returns (local_results, ambiguous) where local_results are batch-style
+    result records and ambiguous is the subset of `matched` still to grade.
+    """
+    scores = local_verdicts(
+        [answer["response"] for _, answer in matched],
+        [qa["answers"] for qa, _ in matched],
+        reject_f1=reject_f1
+    )
+
+    local_results = []
+    ambiguous = []
+    for i, (qa, answer) in enumerate(matched):
+        verdict = scores["verdict"][i]
+        if verdict == 1:
+            reason = "exact match" if scores["exact"][i] else "response contains a gold answer"
+            local_results.append(local_result(qa["id"], True, f"Local check: {reason}."))
+        elif verdict == 0:
+            reason = "response declines to answer" if scores["refused"][i] else "no overlap with any gold answer"
+            local_results.append(local_result(qa["id"], False, f"Local check: {reason}."))
+        else:
+            ambiguous.append((qa, answer))
+
+    total = len(matched)
+    avoided = len(local_results)
+    print(f"{name}: graded {avoided} / {total} answers locally, "
+          f"{avoided / total if total else 0:.1%} of grader calls avoided; {len(ambiguous)} sent to the grader")
+    return local_results, ambiguous
+
+
+def append_results(path, results):
+    """
+    Append result records to a grading results file.
+    """
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+
+
+def grading_task(qa, answer):
+    """
+    The batch request asking the grader whether `answer` matches the gold answers of `qa`.
+    """
+    return {
+        # The question id lets results be joined back to the dataset
+        "custom_id": qa["id"],
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": "gpt-4o-mini",
+            "temperature": 0,
+            # The grading instructions form a static prefix; only the question and answers vary
+            "messages": grading_messages(qa["question"], answer["response"], qa["answers"]),
+            "response_format": GRADING_RESPONSE_FORMAT,
+            "max_tokens": GRADING_MAX_TOKENS,
+        }
+    }
+
+
+def artifact_path(path, kind):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{kind}{ext}"
+
+
+def packed_grading_task(custom_id, pack):
+    """
+    The batch request grading every (qa, answer) pair of `pack` at once.
+
+    Items are numbered from 1 within the pack; the grader keys its verdicts by those numbers.
+    """
+    items = [(str(n), qa["question"], answer["response"], qa["answers"]) for n, (qa, answer) in enumerate(pack, 1)]
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": "gpt-4o-mini",
+            "temperature": 0,
+            "messages": packed_grading_messages(items),
+            "response_format": PACKED_GRADING_RESPONSE_FORMAT,
+            "max_tokens": GRADING_MAX_TOKENS + PACKED_TOKENS_PER_ITEM * len(pack),
+        }
+    }
+
+
+def parse_packed_scores(result, size):
+    """
+    The verdicts of a packed grading result as a list of `size` booleans, in item order.
+
+    Returns None when the pack is malformed: the request failed, the content
+    does not parse, or the item ids are not exactly 1..size, each once.
+    """
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    try:
+        grades = json.loads(response["body"]["choices"][0]["message"]["content"])["grades"]
+        scores = {}
+        for grade in grades:
+            if not isinstance(grade["score"], bool) or grade["id"] in scores:
+                return None
+            scores[grade["id"]] = grade["score"]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    if scores.keys() != {str(n) for n in range(1, size + 1)}:
+        return None
+    return [scores[str(n)] for n in range(1, size + 1)]
+
+
+def packed_item_result(result, question_id, score, usage=None):
+    """
+    One answer's verdict from a packed result, in the same shape as a batch output line.
+
+    The pack's token usage is carried by its first item only, so usage totals count each request once.
+    """
+    body = result["response"]["body"]
+    item_body = {
+        "model": body.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps({"score": score})},
+            "finish_reason": "stop"
+        }]
+    }
+    if usage is not None:
+        item_body["usage"] = usage
+    item = {
+        "id": result["id"],
+        "custom_id": question_id,
+        "response": {"status_code": 200, "request_id": result["response"].get("request_id"), "body": item_body},
+        "error": None,
+        "pack": result["custom_id"],
+    }
+    if result.get("from_cache"):
+        item["from_cache"] = True
+    return item
+
+
+def grade_packed(client, matched, pack_size, name, input_path, results_path, cache=None):
+    """
+    Grade (qa, answer) pairs `pack_size` at a time through the batch API.
+
+    Packs whose result fails validation (see parse_packed_scores()) are not
+    trusted at all: their pairs are returned for single-item grading. The
+    raw pack results are kept in `<results_path>.packed`.
+
+    Returns (item_results, fallback): result lines for the answers graded in
+    valid packs, and the pairs still to be graded one by one.
+    """
+    packs = [matched[start:start + pack_size] for start in range(0, len(matched), pack_size)]
+    tasks = [packed_grading_task(f"pack-{n:05d}", pack) for n, pack in enumerate(packs)]
+    sizes = {task["custom_id"]: len(pack) for task, pack in zip(tasks, packs)}
+
+    output_path = artifact_path(results_path, "packed")
+    run_cached_batch(client, tasks, artifact_path(input_path, "packed"), output_path, cache,
+                     accept=lambda result: parse_packed_scores(result, sizes[result["custom_id"]]) is not None)
+
+    item_results = []
+    fallback = []
+    malformed = 0
+    with JsonlReader(output_path) as results:
+        for task, pack in zip(tasks, packs):
+            result = results.get(task["custom_id"])
+            scores = parse_packed_scores(result, len(pack)) if result is not None else None
+            if scores is None:
+                malformed += 1
+                fallback.extend(pack)
+                continue
+            usage = result["response"]["body"].get("usage")
+            for n, ((qa, answer), score) in enumerate(zip(pack, scores)):
+                item_results.append(packed_item_result(result, qa["id"], score, usage if n == 0 else None))
+
+    print(f"{name}: graded {len(item_results)} answers in {len(packs)} packed requests of up to {pack_size}; "
+          f"{malformed} malformed packs, {len(fallback)} answers fall back to single grading")
+    return item_results, fallback
+
+
+def regrade_failures(client, tasks, input_path, results_path, attempts=1, cache=None):
+    """
+    Re-submit the grading tasks whose result failed as a targeted batch.
+
+    Rows of `results_path` that fail (see result_score()) or are missing are
+    re-graded with a larger token cap, bypassing the response cache, and
+    replaced in place by the re-graded rows that succeed; rows missing from
+    the file are added at its end. Up to `attempts` batches are run.
+    Successful re-grades are added to `cache`. The results file is streamed;
+    only the failed rows are held in memory.
+
+    Returns the custom_ids that still have no valid result.
+    """
+    by_id = {task["custom_id"]: task for task in tasks}
+    present = set()
+    failed = []
+    for result in iter_jsonl(results_path):
+        present.add(result["custom_id"])
+        if result["custom_id"] in by_id and result_score(result) is None:
+            failed.append(result["custom_id"])
+    failed.extend(cid for cid in by_id if cid not in present)
+    if not failed:
+        return []
+
+    results = {}
+    for attempt in range(attempts):
+        if not failed:
+            break
+        print(f"Re-grading {len(failed)} failed grader rows (attempt {attempt + 1} of {attempts})")
+        retry_tasks = [
+            dict(by_id[cid], body=dict(by_id[cid]["body"], max_tokens=REGRADE_MAX_TOKENS)) for cid in failed
+        ]
+        retry_output = artifact_path(results_path, "regrade")
+        run_cached_batch(client, retry_tasks, artifact_path(input_path, "regrade"), retry_output)
+        for result in iter_jsonl(retry_output):
+            if result_score(result) is not None:
+                results[result["custom_id"]] = result
+                if cache is not None:
+                    # Stored under the original request, so the next run finds the good verdict
+                    cache.put_many([(task_key(by_id[result["custom_id"]]), result["response"])])
+        os.remove(retry_output)
+        failed = [cid for cid in failed if result_score(results.get(cid, {})) is None]
+
+    def merged():
+        for result in iter_jsonl(results_path):
+            yield results.pop(result["custom_id"], result)
+        yield from results.values()
+    write_jsonl(results_path, merged())
+
+    if failed:
+        print(f"{len(failed)} grader rows still failed after re-grading; they count as incorrect")
+    return failed
+
+
+def grade_matched(matched, name, input_path, results_path, client=None, use_cache=True, regrade_attempts=1,
+                  pack_size=GRADING_PACK_SIZE):
+    """
+    Grade joined (qa, answer) pairs with the batch grader and write the verdicts to `results_path`.
+
+    Each result's custom_id is its `qa["id"]`. See grade_answers() for the
+    response cache, re-grading and `pack_size`.
+    """
+    if not matched:
+        open(results_path, 'w').close()
+        return
+
+    client = client or clients.openai_client()
+    cache = clients.response_cache().scoped(results_path) if use_cache else None
+
+    packed_results = []
+    if pack_size > 1:
+        packed_results, matched = grade_packed(client, matched, pack_size, name, input_path, results_path, cache)
+
+    tasks = [grading_task(qa, answer) for qa, answer in matched]
+
+    if tasks:
+        # Submit the uncached grading tasks as sharded batches (or resume tracked ones) and save the results
+        # Only verdicts that parse are cached, so a failed row is never replayed
+        run_cached_batch(client, tasks, input_path, results_path, cache,
+                         accept=lambda result: result_score(result) is not None)
+        regrade_failures(client, tasks, input_path, results_path, regrade_attempts, cache)
+    else:
+        open(results_path, 'w').close()
+
+    # Add the packed answers to the same results file
+    append_results(results_path, packed_results)
+
+    if cache is not None:
+        cache.print_stats(f"{name} grader response cache")
+    print_cache_usage(iter_jsonl(results_path), f"{name} grader")
+    telemetry.record_batch_results("score", iter_jsonl(results_path))
+
+
+def grade_answers(answers, name, input_path, results_path, question_ids=None, local_tier=True, client=None,
+                  use_cache=True, regrade_attempts=1, pack_size=GRADING_PACK_SIZE, squad_path=SQUAD_PATH):
+    """
+    Grade model answers against the SQuAD gold answers with the OpenAI batch API.
+
+    `answers` are dicts with "id", "question" and "response" keys. They are
+    joined to their gold answers in the SQuAD file at `squad_path` by question id, so they may be any
+    subset of questions in any order; pass `question_ids` to grade only those.
+
+    With `local_tier`, answers that clearly match or miss every gold answer
+    are graded locally and only the ambiguous rest is sent to the batch
+    grader. With `use_cache`, grading requests identical to earlier ones are
+    answered from the response cache. The grader returns structured output;
+    rows that fail to parse are re-graded in a targeted batch, up to
+    `regrade_attempts` times (see regrade_failures()). With `pack_size` above
+    1, answers are graded that many per request and malformed packs fall back
+    to single-item grading (see grade_packed()). Batch, packed, cached and
+    local verdicts are written to `results_path` in the same format.
+    """
+    # Join responses to their gold answers by question id instead of by position
+    matched, unmatched = join_answers(load_index(squad_path), answers, question_ids)
+    report_join(matched, unmatched, name)
+
+    # Settle clear-cut answers locally; only the ambiguous middle band goes to the grader
+    local_results = []
+    if local_tier:
+        local_results, matched = pre_score(matched, name)
+
+    grade_matched(matched, name, input_path, results_path, client, use_cache, regrade_attempts, pack_size)
+
+    # Add the locally graded answers to the same results file
+    append_results(results_path, local_results)
+
+
+def grade_answer_sets(answer_sets, input_path, results_path, local_tier=True, client=None, use_cache=True,
+                      regrade_attempts=1, pack_size=GRADING_PACK_SIZE, squad_path=SQUAD_PATH):
+    """
+    Grade the answers of several models or configurations in one combined batch.
+
+    `answer_sets` maps a label to (answers, results_path). Every set is joined
+    and pre-scored on its own, then the grader requests of all sets are sent
+    together, with custom_id "<label>/<question id>", and their raw results
+    written to `results_path`. Finally the results are split into each set's
+    own results file under plain question ids, in the same format as
+    grade_answers(), so each can be aggregated like a single run.
+    """
+    index = load_index(squad_path)
+    combined = []
+    local_results = {}
+    for label, (answers, _) in answer_sets.items():
+        matched, unmatched = join_answers(index, answers)
+        report_join(matched, unmatched, label)
+        local_results[label] = []
+        if local_tier:
+            local_results[label], matched = pre_score(matched, label)
+        combined.extend((dict(qa, id=f"{label}/{qa['id']}"), answer) for qa, answer in matched)
+
+    print(f"Grading {len(combined)} answers from {len(answer_sets)} configurations in one batch")
+    grade_matched(combined, "combined", input_path, results_path, client, use_cache, regrade_attempts, pack_size)
+
+    outputs = {label: open(path + ".part", 'w') for label, (_, path) in answer_sets.items()}
+    try:
+        for result in iter_jsonl(results_path):
+            # Question ids never contain "/", labels might
+            label, question_id = result["custom_id"].rsplit("/", 1)
+            outputs[label].write(json.dumps(dict(result, custom_id=question_id)) + '\n')
+        for label, results in local_results.items():
+            for result in results:
+                outputs[label].write(json.dumps(result) + '\n')
+    finally:
+        for output in outputs.values():
+            output.close()
+    for label, (_, path) in answer_sets.items():
+        os.replace(path + ".part", path)
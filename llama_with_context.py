@@ -1,113 +1,313 @@
-import json
+import argparse
+import asyncio
 import os
 import time
 
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
-import chromadb
-from chromadb.utils import embedding_functions
+import clients
+import telemetry
+from artifacts import iter_jsonl
+from checkpoint import append_record, load_completed, rewrite_in_order
+from context_packing import DEFAULT_CONTEXT_TOKENS, packed_prompts, print_prompt_stats, write_prompt_stats
+from prompts import print_cache_usage, usage_tokens
+from response_cache import response_key
+from retrieval import retrieve_for_questions
+from squad_dataset import possible_questions
+from throttling import TokenBucket, call_with_retry
 
-load_dotenv()
+LLAMA_OUTPUT_PATH = 'data/llama_output.json'
+LLAMA_PROMPT_STATS_PATH = 'data/llama_prompt_stats.jsonl'
 
-openai_client = ChatCompletionsClient(
-    endpoint=os.environ["AZURE_MLSTUDIO_ENDPOINT"],
-    credential=AzureKeyCredential(os.environ["AZURE_MLSTUDIO_KEY"]),
-)
+def build_prompts(questions, retrieved, context_tokens=DEFAULT_CONTEXT_TOKENS, trim_context=False,
+                  stats_path=LLAMA_PROMPT_STATS_PATH, variant="default", resume=False):
+    """
+    Build the chat messages for every question from its packed context.
+
+    The prompt size of each request, counted locally, is written to
+    `stats_path` so runs with different budgets can be compared. A fresh run
+    replaces the file; with `resume`, the rows of other questions (answered
+    before the interruption) are kept and those of `questions` replaced, so
+    every question has one row. `variant` selects the system prompt (see
+    prompts.GENERATION_VARIANTS).
+
+    Returns a dict mapping each question id to its list of chat messages (role/content dicts).
+    """
+    prompts = {}
+    prompt_stats = []
+    for item, messages, stats in packed_prompts(questions, retrieved, context_tokens, trim_context, variant):
+        prompts[item["id"]] = messages
+        prompt_stats.append(stats)
 
-chroma_client = chromadb.PersistentClient(path="data/my_chromadb")
+    kept = []
+    if resume and os.path.exists(stats_path):
+        rebuilt = {row["id"] for row in prompt_stats}
+        kept = [row for row in iter_jsonl(stats_path) if row["id"] not in rebuilt]
+    write_prompt_stats(stats_path, kept + prompt_stats)
+    print_prompt_stats(prompt_stats)
+    return prompts
 
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    model_name="text-embedding-3-small"
-)
+def azure_messages(messages):
+    from azure.ai.inference.models import SystemMessage, UserMessage
+    roles = {"system": SystemMessage, "user": UserMessage}
+    return [roles[m["role"]](content=m["content"]) for m in messages]
 
-collection = chroma_client.get_collection(
-    name="squad_contexts",
-    embedding_function=openai_ef
-)
+def cache_keys(prompts, model=None):
+    """
+    Response cache keys for the prompts built by build_prompts(), by question id.
 
-system_prompt = "You are a smart AI model. Answer this question correctly and keep it as short and concise as possible, prioritizing answering questions correctly."
-user_prompt = """You are a smart AI assistant that answers questions using data returned by a search engine.
+    Unless a `model` is named, the Azure endpoint stands in for the model name, since it identifies the deployment.
+    """
+    model = model or os.environ.get("AZURE_MLSTUDIO_ENDPOINT", "llama")
+    return {qid: response_key("azure", model, None, messages) for qid, messages in prompts.items()}
+
+def cached_record(item, value):
+    return {"id": item["id"], "question": item["question"], **value, "from_cache": True}
+
+def cache_value(record):
+    return {field: record[field] for field in ("response", "input_tokens", "cached_tokens", "output_tokens")}
+
+def answer_record(item, response):
+    """
+    The output record for one answered question, with its token usage.
+    """
+    prompt_tokens, cached_tokens = usage_tokens(response.usage)
+    return {
+        "id": item["id"],
+        "question": item["question"],
+        "response": response.choices[0].message.content,
+        "input_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": response.usage.completion_tokens
+    }
 
-Guidelines:
-\t1. You will be provided with a question by the user, you must answer that question, and nothing else.
-\t2. Your answer should come directly from the provided context from the search engine.
-\t3. Do not make up any information not provided in the context.
-\t4. If the provided question does not contain the answers, respond with 'I am sorry, but I am unable to answer that question.'
-\t5. Be aware that some chunks in the context may be irrelevant, incomplete, and/or poorly formatted.
+def run_cost(results):
+    """
+    USD cost of the answer records that were not served from the response cache.
+    """
+    return sum(
+        telemetry.cost("llama", r["input_tokens"], r["output_tokens"], r["cached_tokens"])
+        for r in results if not r.get("from_cache")
+    )
 
-Here is the provided context:
-{context}
+def resume_state(questions, output_path, resume=True):
+    """
+    Find which questions still need an answer in `output_path`.
 
-Here is the question: {question}
+    Records are matched by SQuAD question id, or by question text for records
+    written before ids were stored. With `resume=False` the output file is
+    emptied and every question is pending.
 
-Your response: """
+    Returns the pending questions and the key function used to match records.
+    """
+    id_by_question = {q["question"]: q["id"] for q in questions}
 
-def retrieve_context(idx, question, n_results=5):
-    results = collection.query(query_texts=[question], n_results=n_results)
-    return results["documents"][0]
+    def output_key(record):
+        return record.get("id") or id_by_question.get(record["question"], record["question"])
 
-def possible_questions():
-    with open("data/dev-v2.0.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if not resume:
+        open(output_path, 'w').close()
 
-    valid_responses = []
-    for article in data["data"]:
-        for paragraph in article["paragraphs"]:
-            for qa in paragraph["qas"]:
-                if not qa["is_impossible"]:
-                    valid_responses.append(qa["question"])
-                if len(valid_responses) >= 500:
-                    return valid_responses
+    completed = load_completed(output_path, key=output_key)
+    pending = [q for q in questions if q["id"] not in completed]
+    pending = list({q["id"]: q for q in pending}.values())
+    if completed:
+        print(f"Resuming: {len(questions) - len(pending)} questions already answered, {len(pending)} remaining")
+    return pending, output_key
 
-def llama_answers(questions):
+def llama_answers(questions, retrieved=None, client=None, output_path=LLAMA_OUTPUT_PATH, resume=True,
+                  context_tokens=DEFAULT_CONTEXT_TOKENS, trim_context=False, use_cache=True, model=None,
+                  variant="default", stats_path=LLAMA_PROMPT_STATS_PATH):
     """
     Generate answers using the Llama model via Azure's ChatCompletionsClient.
 
-    This function reads questions from 'dev-v2.0.json', submits each question to the Llama model,
-    and appends the responses to 'llama8Boutput.json'.
+    This function submits each question to the Llama model and appends the responses to
+    'llama_output.json', one flushed line per answer. Questions already answered in the
+    output file are skipped, so an interrupted run picks up where it stopped. Once every
+    question is answered the file is rewritten in question order.
+
+    `retrieved` maps each question to its context chunks; when omitted the top 5
+    chunks are retrieved with the shared retriever. Retrieved chunks are packed
+    into a `context_tokens` budget (see build_prompts()). With `use_cache`,
+    prompts identical to earlier ones are answered from the response cache.
+    `model` names the model of a multi-model endpoint; by default the
+    endpoint's own model answers. `variant` selects the system prompt.
     """
-    client = ChatCompletionsClient(
-        endpoint=os.environ["AZURE_MLSTUDIO_ENDPOINT"],
-        credential=AzureKeyCredential(os.environ["AZURE_MLSTUDIO_KEY"]),
-    )
+    client = client or clients.azure_chat_client()
+
+    pending, output_key = resume_state(questions, output_path, resume)
+
+    if retrieved is None:
+        # Retrieve top 5 context chunks for every question before generation starts
+        retrieved = retrieve_for_questions(clients.retriever(), pending, n_results=5,
+                                           embedding_function=clients.query_embedding_function())
+    prompts = build_prompts(pending, retrieved, context_tokens, trim_context, stats_path, variant, resume)
+    keys = cache_keys(prompts, model)
+    options = {"model": model} if model else {}
+    cache = clients.response_cache().scoped(output_path) if use_cache else None
+    cached = cache.get_many(list(keys.values())) if cache is not None else {}
+
+    response = None
+    results = []
 
     # Open the output file in append mode
-    with open('data/llama_output.json', 'a') as output_file:
-        for idx, question in enumerate(questions, 1):
+    with open(output_path, 'a') as output_file:
+        for idx, item in enumerate(pending, 1):
             # Submit the question to the Llama model
-            context_chunks = retrieve_context(idx, question, n_results=5)
-            context = "\n\n".join(context_chunks)
-
-            formatted_user_prompt = user_prompt.format(context=context, question=question)
-
-            response = client.complete(
-                messages=[
-                    SystemMessage(
-                        content=system_prompt,
-                    ),
-                    UserMessage(content=formatted_user_prompt),
-                ],
-            )
-            # Structure the result
-            result = {
-                "question": question,
-                "response": response.choices[0].message.content,
-                "input_tokens": response.usage.prompt_tokens,
-                "output_tokens": response.usage.completion_tokens
-            }
-
-            print(f"{idx} / {len(questions)} Questions answered: {question}")
-            output_file.write(json.dumps(result) + '\n')
+            question = item["question"]
+
+            key = keys[item["id"]]
+            if key in cached:
+                result = cached_record(item, cached[key])
+            else:
+                start = time.perf_counter()
+                response = client.complete(messages=azure_messages(prompts[item["id"]]), **options)
+                telemetry.record_request("generate", model or "llama", response.usage, time.perf_counter() - start)
+                # Structure the result
+                result = answer_record(item, response)
+                if cache is not None:
+                    cache.put(key, cache_value(result))
+            results.append(result)
 
+            print(f"{idx} / {len(pending)} Questions answered: {question}")
+            append_record(output_file, result)
+
+    rewrite_in_order(output_path, [q["id"] for q in questions], key=output_key)
+
+    if cache is not None:
+        cache.print_stats("llama response cache")
+    if response is None:
+        return
+
+    print_cache_usage(results, "llama")
     print("Model's Response:")
     print('\t', response.choices[0].message.content)
     print()
-    print(f"Input Tokens:  {response.usage.prompt_tokens}")
+    print(f"Input Tokens:  {response.usage.prompt_tokens} ({usage_tokens(response.usage)[1]} cached)")
     print(f"Output Tokens: {response.usage.completion_tokens}")
-    print(f"Cost: ${response.usage.prompt_tokens * 0.0003 / 1000 + response.usage.completion_tokens * 0.00061 / 1000}")
+    print(f"Cost of this run: ${run_cost(results):.4f}")
+
+async def llama_answers_async(questions, retrieved=None, client=None, concurrency=8,
+                              requests_per_second=10.0, max_retries=5,
+                              output_path=LLAMA_OUTPUT_PATH, resume=True,
+                              context_tokens=DEFAULT_CONTEXT_TOKENS, trim_context=False, use_cache=True,
+                              model=None, variant="default", stats_path=LLAMA_PROMPT_STATS_PATH):
+    """
+    Generate answers with many Llama requests in flight at once.
+
+    At most `concurrency` requests are outstanding and at most
+    `requests_per_second` are started per second. Rate-limit (429) and 5xx
+    errors are retried with jittered exponential backoff. Each result is
+    appended to `output_path` as soon as it arrives, in the same format as
+    `llama_answers()`, so a failure or crash loses no finished answer; the
+    file is put back in question order at the end. Like `llama_answers()`,
+    questions already in the output file are skipped and, with `use_cache`,
+    cached responses are reused without a request; `model` and `variant` work
+    the same way too.
+    """
+    pending_questions, output_key = resume_state(questions, output_path, resume)
+
+    if retrieved is None:
+        retrieved = retrieve_for_questions(clients.retriever(), pending_questions, n_results=5,
+                                           embedding_function=clients.query_embedding_function())
+    prompts = build_prompts(pending_questions, retrieved, context_tokens, trim_context, stats_path, variant,
+                            resume)
+    keys = cache_keys(prompts, model)
+    options = {"model": model} if model else {}
+    cache = clients.response_cache().scoped(output_path) if use_cache else None
+    cached = cache.get_many(list(keys.values())) if cache is not None else {}
+
+    owns_client = client is None
+    if owns_client:
+        # Retries are handled by call_with_retry, so the SDK's own retry policy is disabled
+        client = clients.async_azure_chat_client()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(requests_per_second)
+
+    async def answer(item):
+        key = keys[item["id"]]
+        if key in cached:
+            return cached_record(item, cached[key])
+
+        messages = azure_messages(prompts[item["id"]])
+
+        async def make_call():
+            await bucket.acquire()
+            return await client.complete(messages=messages, **options)
+
+        async with semaphore:
+            # Latency covers retries and rate limiting, as seen by the caller
+            start = time.perf_counter()
+            response = await call_with_retry(make_call, max_retries=max_retries)
+            telemetry.record_request("generate", model or "llama", response.usage, time.perf_counter() - start)
+
+        result = answer_record(item, response)
+        if cache is not None:
+            cache.put(key, cache_value(result))
+        return result
+
+    tasks = [asyncio.create_task(answer(item)) for item in pending_questions]
+
+    # Results arrive out of order; each is checkpointed right away and the file reordered at the end
+    results = []
+    try:
+        with open(output_path, 'a') as output_file:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                append_record(output_file, result)
+                results.append(result)
+                print(f"{len(results)} / {len(tasks)} Questions answered: {result['question']}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let the cancelled requests unwind before the client closes
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if owns_client:
+            await client.close()
+
+    rewrite_in_order(output_path, [q["id"] for q in questions], key=output_key)
+    print_cache_usage(results, "llama")
+    print(f"Cost of this run: ${run_cost(results):.4f}")
+    if cache is not None:
+        cache.print_stats("llama response cache")
+
+def read_llama_answers(path=LLAMA_OUTPUT_PATH):
+    """
+    Yield the answers in a Llama output file, as dicts with "id", "question" and "response".
+    """
+    # Extract questions and Llama's responses
+    for entry in iter_jsonl(path):
+        yield {"id": entry.get("id"), "question": entry["question"], "response": entry["response"]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer SQuAD questions with Llama using retrieved context.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="send requests concurrently instead of one at a time")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum requests in flight (async mode)")
+    parser.add_argument("--rps", type=float, default=10.0, help="maximum requests started per second (async mode)")
+    parser.add_argument("--max-retries", type=int, default=5, help="retries for 429/5xx errors (async mode)")
+    parser.add_argument("--restart", action="store_true",
+                        help="discard answers already in the output file instead of resuming")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="token budget for the retrieved context in each prompt "
+                             "(default: no budget, every distinct retrieved chunk is kept)")
+    parser.add_argument("--trim-context", action="store_true",
+                        help="trim chunks to the sentences around the question terms")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="send every request instead of reusing cached responses")
+    args = parser.parse_args()
 
-questions = possible_questions()
-llama_answers(questions)
\ No newline at end of file
+    questions = possible_questions()
+    if args.use_async:
+        asyncio.run(llama_answers_async(
+            questions,
+            concurrency=args.concurrency,
+            requests_per_second=args.rps,
+            max_retries=args.max_retries,
+            resume=not args.restart,
+            context_tokens=args.context_tokens,
+            trim_context=args.trim_context,
+            use_cache=not args.no_response_cache
+        ))
+    else:
+        llama_answers(questions, resume=not args.restart, context_tokens=args.context_tokens,
+                      trim_context=args.trim_context, use_cache=not args.no_response_cache)
\ No newline at end of file
@@ -0,0 +1,95 @@
+import re
+import string
+from collections import Counter
+
+ARTICLES = re.compile(r"\b(a|an|the)\b")
+PUNCTUATION = str.maketrans("", "", string.punctuation)
+
+# Responses that decline to answer; these are never correct for answerable questions
+REFUSALS = ("unable to answer", "cannot answer", "can't answer", "does not contain", "not provided in the context")
+
+
+def normalize_answer(text):
+    """
+    SQuAD answer normalization: lowercase, drop punctuation and articles, squeeze whitespace.
+    """
+    text = text.lower().translate(PUNCTUATION)
+    text = ARTICLES.sub(" ", text)
+    return " ".join(text.split())
+
+
+def token_f1(prediction_tokens, gold_tokens):
+    common = Counter(prediction_tokens) & Counter(gold_tokens)
+    overlap = sum(common.values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / len(prediction_tokens)
+    recall = overlap / len(gold_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def answer_features(response, gold_answers):
+    """
+    Best exact match, token F1 and containment of a response over all gold answers.
+
+    Containment means a normalized gold answer appears as a whole-token span
+    inside the normalized response, which catches full-sentence answers such
+    as "Normandy is located in France." for the gold span "France".
+    """
+    prediction = normalize_answer(response)
+    prediction_tokens = prediction.split()
+    padded = f" {prediction} "
+
+    exact = f1 = 0.0
+    contained = False
+    for gold in gold_answers:
+        gold = normalize_answer(gold)
+        if not gold:
+            continue
+        exact = max(exact, float(prediction == gold))
+        f1 = max(f1, token_f1(prediction_tokens, gold.split()))
+        contained = contained or f" {gold} " in padded
+    return exact, f1, contained
+
+
+def local_verdicts(responses, gold_answer_lists, reject_f1=None):
+    """
+    Score many responses at once and decide which can skip the LLM grader.
+
+    Returns a dict of numpy arrays, one entry per response:
+        exact, f1, contained   - the features from answer_features()
+        refused                - the response declines to answer
+        verdict                - 1 correct, 0 incorrect, -1 ambiguous (needs the LLM grader)
+
+    A response is correct when it matches or contains a gold answer, and
+    incorrect when it refuses to answer. A refusal phrase next to a gold
+    answer ("Pure water does not contain salt.") is left to the grader. If
+    `reject_f1` is set, responses whose best token F1 is at most that value
+    are also marked incorrect; this is off by default because paraphrased
+    answers ("Catholicism" for "catholic") share no tokens with the gold
+    span. Everything else is left to the grader.
+    """
+    # Imported here so that importing the grading and accuracy modules does not load numpy
+    import numpy as np
+
+    features = [answer_features(r, golds) for r, golds in zip(responses, gold_answer_lists)]
+    exact = np.array([f[0] for f in features], dtype=np.float32)
+    f1 = np.array([f[1] for f in features], dtype=np.float32)
+    contained = np.array([f[2] for f in features], dtype=bool)
+    lowered = [r.lower() for r in responses]
+    refused = np.array([any(phrase in r for phrase in REFUSALS) for r in lowered], dtype=bool)
+
+    matched = (exact == 1.0) | contained
+    correct = matched & ~refused
+    incorrect = ~matched & refused
+    if reject_f1 is not None:
+        incorrect |= ~matched & (f1 <= reject_f1)
+    verdict = np.where(correct, 1, np.where(incorrect, 0, -1))
+
+    return {
+        "exact": exact,
+        "f1": f1,
+        "contained": contained,
+        "refused": refused,
+        "verdict": verdict,
+    }
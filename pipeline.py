@@ -0,0 +1,237 @@
+"""
+End-to-end pipeline: ingest -> retrieve -> generate -> score -> report.
+
+Each stage records a key built from its parameters, the keys of the stages
+it depends on and the content hashes of its input files. A stage whose key
+and outputs are unchanged since its last successful run is skipped, so
+re-running the pipeline only repeats the work that is actually stale. An
+interrupted stage re-runs with the same key and resumes where its tools
+support it (tracked batch jobs, the Llama output checkpoint).
+
+    python pipeline.py                               # every stage, both providers
+    python pipeline.py --providers llama --stages generate score report
+    python pipeline.py --backend bm25 --force        # rebuild everything with lexical retrieval
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import clients
+import telemetry
+from accuracy import REPORT_PATH, aggregate_file, print_summary, write_report
+from artifacts import file_sha256
+from context_packing import DEFAULT_CONTEXT_TOKENS
+from data_preprocessing import CHROMA_PATH, get_collection, preprocessing
+from grading import GRADING_PACK_SIZE
+from providers import PROVIDERS, get_provider
+from retrieval import RETRIEVER_BACKEND, record_retrieval_hits, retrieve_results
+from squad_dataset import SQUAD_PATH, possible_questions
+
+PIPELINE_STATE_PATH = "data/pipeline_state.json"
+RETRIEVED_PATH = "data/retrieved_contexts.json"
+STAGES = ("ingest", "retrieve", "generate", "score", "report")
+
+
+def input_fingerprints(paths):
+    """
+    Content hashes of the input files, so an input rewritten with the same bytes keeps its dependents' keys.
+    """
+    return {path: file_sha256(path) if os.path.exists(path) else None for path in paths}
+
+
+class Pipeline:
+    """
+    Runs the pipeline stages for a set of providers, skipping stages that are up to date.
+    """
+
+    def __init__(self, providers, data_path=SQUAD_PATH, limit=500, backend=None, n_results=5,
+                 context_tokens=DEFAULT_CONTEXT_TOKENS, trim_context=False, local_tier=True,
+                 use_cache=True, grading_pack_size=GRADING_PACK_SIZE, generate_options=None, force=False,
+                 state_path=PIPELINE_STATE_PATH):
+        self.providers = providers
+        self.data_path = data_path
+        self.limit = limit
+        self.backend = backend or RETRIEVER_BACKEND
+        self.n_results = n_results
+        self.context_tokens = context_tokens
+        self.trim_context = trim_context
+        self.local_tier = local_tier
+        self.use_cache = use_cache
+        self.grading_pack_size = grading_pack_size
+        self.generate_options = generate_options or {}
+        self.force = force
+        self.state_path = state_path
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def stage_key(self, params, inputs=(), depends=()):
+        material = {
+            "params": params,
+            "inputs": input_fingerprints(inputs),
+            "depends": {name: self.state.get(name, {}).get("key") for name in depends},
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def run_stage(self, name, action, outputs, params, inputs=(), depends=()):
+        """
+        Run `action(resume)` unless stage `name` is up to date.
+
+        `resume` is True when the stage last ran with the same key, whether it
+        was interrupted or is being forced; it is False when its parameters or
+        inputs changed. Inputs are compared by content, so forcing an upstream
+        stage that rewrites identical outputs (retrieval is deterministic)
+        still lets the stages after it resume, while different outputs start
+        them afresh.
+        """
+        key = self.stage_key(params, inputs, depends)
+        entry = self.state.get(name, {})
+        up_to_date = entry.get("key") == key and entry.get("completed") and all(map(os.path.exists, outputs))
+        if up_to_date and not self.force:
+            print(f"[{name}] up to date")
+            return False
+
+        resume = entry.get("key") == key
+        print(f"[{name}] running" + (" (resuming)" if resume and not entry.get("completed") else ""))
+        self.state[name] = {"key": key, "completed": False}
+        self.save_state()
+
+        start = time.perf_counter()
+        with telemetry.timed(name):
+            action(resume)
+        self.state[name] = {"key": key, "completed": True, "seconds": round(time.perf_counter() - start, 3)}
+        self.save_state()
+        print(f"[{name}] done in {self.state[name]['seconds']:.1f}s")
+        return True
+
+    def ingest(self, resume):
+        if self.backend == "bm25":
+            from bm25 import load_bm25
+            load_bm25(self.data_path)
+            return
+
+        collection = get_collection(embedding_function=clients.embedding_function(), client=clients.chroma_client())
+        preprocessing(self.data_path, collection=collection)
+        if self.backend == "numpy":
+            from vector_index import export_from_chroma
+            export_from_chroma(collection)
+
+    def retrieve(self, resume):
+        questions = possible_questions(self.limit, self.data_path)
+        results = retrieve_results(clients.retriever(self.backend, self.data_path),
+                                   [q["question"] for q in questions], n_results=self.n_results)
+        record_retrieval_hits(questions, {question: r["documents"] for question, r in results.items()},
+                              squad_path=self.data_path)
+
+        with open(RETRIEVED_PATH, 'w') as f:
+            json.dump({"questions": questions, "results": results}, f)
+
+    def load_retrieved(self):
+        with open(RETRIEVED_PATH) as f:
+            retrieved = json.load(f)
+        contexts = {question: r["documents"] for question, r in retrieved["results"].items()}
+        return retrieved["questions"], contexts
+
+    def run(self, stages=STAGES):
+        index_outputs = {"bm25": ["data/bm25_index.npz"], "numpy": [CHROMA_PATH, "data/vector_index"]}
+        if "ingest" in stages:
+            self.run_stage("ingest", self.ingest, index_outputs.get(self.backend, [CHROMA_PATH]),
+                           {"backend": self.backend}, inputs=[self.data_path])
+
+        if "retrieve" in stages:
+            self.run_stage("retrieve", self.retrieve, [RETRIEVED_PATH],
+                           {"backend": self.backend, "limit": self.limit, "n_results": self.n_results},
+                           depends=["ingest"])
+
+        for provider in self.providers:
+            if "generate" in stages:
+                def generate(resume, provider=provider):
+                    questions, contexts = self.load_retrieved()
+                    provider.generate(questions, contexts, resume=resume, context_tokens=self.context_tokens,
+                                      trim_context=self.trim_context, use_cache=self.use_cache,
+                                      **self.generate_options)
+                self.run_stage(f"generate:{provider.name}", generate, [provider.output_path],
+                               {"context_tokens": self.context_tokens, "trim_context": self.trim_context},
+                               inputs=[RETRIEVED_PATH], depends=["retrieve"])
+
+            if "score" in stages:
+                self.run_stage(f"score:{provider.name}",
+                               lambda resume, provider=provider: provider.grade(
+                                   local_tier=self.local_tier, use_cache=self.use_cache,
+                                   pack_size=self.grading_pack_size, squad_path=self.data_path),
+                               [provider.results_path],
+                               {"local_tier": self.local_tier, "pack_size": self.grading_pack_size},
+                               inputs=[provider.output_path], depends=[f"generate:{provider.name}"])
+
+        if "report" in stages:
+            def report(resume):
+                results = [aggregate_file(p.model, p.results_path, squad_path=self.data_path) for p in self.providers]
+                print_summary(results)
+                # Stages skipped as up to date recorded their telemetry in the run that produced them
+                usage = telemetry.summarize(telemetry.read_events(run=telemetry.run_id()))
+                telemetry.print_summary(usage)
+                write_report(results, telemetry_summary=usage)
+
+            self.run_stage("report", report, [REPORT_PATH + ".json", REPORT_PATH + ".csv"],
+                           {"providers": [p.name for p in self.providers]},
+                           inputs=[p.results_path for p in self.providers],
+                           depends=[f"score:{p.name}" for p in self.providers])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SQuAD RAG pipeline: ingest, retrieve, generate, score, report.")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES, help="stages to run")
+    parser.add_argument("--providers", nargs="+", default=list(PROVIDERS), choices=list(PROVIDERS),
+                        help="models to generate answers with")
+    parser.add_argument("--data", default=SQUAD_PATH, help="SQuAD json file")
+    parser.add_argument("--limit", type=int, default=500, help="answerable questions to answer")
+    parser.add_argument("--backend", default=RETRIEVER_BACKEND, choices=["chroma", "numpy", "bm25", "hybrid"],
+                        help="retriever backend")
+    parser.add_argument("--n-results", type=int, default=5, help="chunks retrieved per question")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS,
+                        help="token budget for the retrieved context in each prompt "
+                             "(default: no budget, every distinct retrieved chunk is kept)")
+    parser.add_argument("--trim-context", action="store_true",
+                        help="trim chunks to the sentences around the question terms")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum Llama requests in flight")
+    parser.add_argument("--rps", type=float, default=10.0, help="maximum Llama requests started per second")
+    parser.add_argument("--no-local-tier", action="store_true",
+                        help="send every answer to the LLM grader instead of pre-scoring clear cases locally")
+    parser.add_argument("--grading-pack-size", type=int, default=GRADING_PACK_SIZE,
+                        help="answers graded per grader request (1 grades each answer on its own)")
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="send every generation and grading request instead of reusing cached responses")
+    parser.add_argument("--force", action="store_true", help="re-run the selected stages even if up to date")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(
+        [get_provider(name) for name in args.providers],
+        data_path=args.data,
+        limit=args.limit,
+        backend=args.backend,
+        n_results=args.n_results,
+        context_tokens=args.context_tokens,
+        trim_context=args.trim_context,
+        local_tier=not args.no_local_tier,
+        use_cache=not args.no_response_cache,
+        grading_pack_size=args.grading_pack_size,
+        generate_options={"concurrency": args.concurrency, "requests_per_second": args.rps},
+        force=args.force,
+    )
+    try:
+        pipeline.run(args.stages)
+    finally:
+        clients.close()
+
+
+if __name__ == "__main__":
+    main()
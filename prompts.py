@@ -0,0 +1,194 @@
+"""
+Prompt templates for generation and grading.
+
+Providers cache prompts by prefix: a request whose leading tokens are
+byte-identical to an earlier request's can reuse the earlier computation
+and is billed less for it. Every template therefore puts all of its static
+content (role, guidelines, output format) first, in the system message, and
+only the per-request values (context, question, answers) in the final user
+message. Nothing variable may be formatted into the static part.
+"""
+
+GENERATION_SYSTEM_PROMPT = """You are a smart AI model. Answer this question correctly and keep it as short and concise as possible, prioritizing answering questions correctly.
+
+You are a smart AI assistant that answers questions using data returned by a search engine.
+
+Guidelines:
+\t1. You will be provided with a question by the user, you must answer that question, and nothing else.
+\t2. Your answer should come directly from the provided context from the search engine.
+\t3. Do not make up any information not provided in the context.
+\t4. If the provided question does not contain the answers, respond with 'I am sorry, but I am unable to answer that question.'
+\t5. Be aware that some chunks in the context may be irrelevant, incomplete, and/or poorly formatted."""
+
+# Alternative system prompts for comparing instructions; each keeps its own static, cacheable prefix
+GENERATION_VARIANTS = {
+    "default": GENERATION_SYSTEM_PROMPT,
+    "concise": GENERATION_SYSTEM_PROMPT + """
+\t6. Answer with the shortest phrase from the context that answers the question, not a full sentence.""",
+}
+
+GENERATION_USER_PROMPT = """Here is the provided context:
+{context}
+
+Here is the question: {question}
+
+Your response: """
+
+GRADING_SYSTEM_PROMPT = """You are a teacher tasked with determining whether a student's answer to a question was correct, based on a set of possible correct answers.
+
+Respond only with JSON: {"score": true} if the student's answer was correct, otherwise {"score": false}."""
+
+# Structured output for the grader: a single boolean, so a verdict costs a handful of output tokens
+GRADING_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "grade",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"score": {"type": "boolean"}},
+            "required": ["score"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+GRADING_USER_PROMPT = """Question: {question}
+Student's Response: {student_response}
+Possible Correct Answers: {correct_answers}"""
+
+PACKED_GRADING_SYSTEM_PROMPT = """You are a teacher tasked with determining whether each student's answer to a question was correct, based on a set of possible correct answers.
+
+You will be given several items, each with an ID, a question, the student's response and the possible correct answers. Grade every item on its own.
+
+Respond only with JSON: {"grades": [{"id": "<item ID>", "score": true or false}, ...]}, with exactly one entry per item, in the order given."""
+
+PACKED_GRADING_ITEM = """ID: {id}
+""" + GRADING_USER_PROMPT
+
+# Structured output for packed grading: one {id, score} verdict per item
+PACKED_GRADING_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "grades",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "grades": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"id": {"type": "string"}, "score": {"type": "boolean"}},
+                        "required": ["id", "score"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["grades"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def generation_messages(context, question, variant="default"):
+    """
+    Chat messages asking a model to answer `question` from the retrieved `context`.
+
+    `variant` names the system prompt to use (see GENERATION_VARIANTS).
+    """
+    return [
+        {"role": "system", "content": GENERATION_VARIANTS[variant]},
+        {"role": "user", "content": GENERATION_USER_PROMPT.format(context=context, question=question)},
+    ]
+
+
+def grading_messages(question, student_response, correct_answers):
+    """
+    Chat messages asking the grader whether `student_response` matches any of `correct_answers`.
+    """
+    user_prompt = GRADING_USER_PROMPT.format(
+        question=question,
+        student_response=student_response,
+        correct_answers="; ".join(answer.lower() for answer in correct_answers)
+    )
+    return [
+        {"role": "system", "content": GRADING_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def packed_grading_messages(items):
+    """
+    Chat messages asking the grader to grade several responses at once.
+
+    `items` are (item_id, question, student_response, correct_answers) tuples.
+    """
+    user_prompt = "\n\n".join(
+        PACKED_GRADING_ITEM.format(
+            id=item_id,
+            question=question,
+            student_response=student_response,
+            correct_answers="; ".join(answer.lower() for answer in correct_answers)
+        )
+        for item_id, question, student_response, correct_answers in items
+    )
+    return [
+        {"role": "system", "content": PACKED_GRADING_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def usage_tokens(usage):
+    """
+    (prompt_tokens, cached_tokens) from a response's usage, as a dict or SDK object.
+
+    Providers that do not report prompt caching count as zero cached tokens.
+    """
+    if not usage:
+        return 0, 0
+    if not isinstance(usage, dict):
+        usage = usage.as_dict() if hasattr(usage, "as_dict") else vars(usage)
+    details = usage.get("prompt_tokens_details") or {}
+    return usage.get("prompt_tokens") or 0, details.get("cached_tokens") or 0
+
+
+def record_usage(record):
+    """
+    (prompt_tokens, cached_tokens) of one output record.
+
+    Handles batch output lines, whose usage is in the response body, and the
+    Llama output records, which carry "input_tokens" and "cached_tokens".
+    Records answered from the response cache cost nothing and count as zero.
+    """
+    if record.get("from_cache"):
+        return 0, 0
+    if "response" in record and isinstance(record["response"], dict):
+        return usage_tokens(record["response"].get("body", {}).get("usage"))
+    return record.get("input_tokens") or 0, record.get("cached_tokens") or 0
+
+
+def cache_usage(records):
+    """
+    Total prompt and cached tokens over output records, and the share of prompt tokens served from cache.
+    """
+    totals = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+    for record in records:
+        prompt_tokens, cached_tokens = record_usage(record)
+        if not prompt_tokens:
+            # Locally graded results never reached a model
+            continue
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["cached_tokens"] += cached_tokens
+    totals["cache_hit_rate"] = (
+        round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+    )
+    return totals
+
+
+def print_cache_usage(records, name):
+    usage = cache_usage(records)
+    print(f"{name}: {usage['cached_tokens']} / {usage['prompt_tokens']} prompt tokens served from the prompt cache "
+          f"({usage['cache_hit_rate']:.1%}) over {usage['requests']} requests")
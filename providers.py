@@ -0,0 +1,155 @@
+"""
+Answer-generation providers, one plugin per model.
+
+A provider knows how to answer questions from retrieved contexts, where its
+answers and grading results are stored, and how to read its answers back.
+Everything else (retrieval, grading, reporting) is shared. New models are
+added by subclassing Provider and registering an instance.
+"""
+import asyncio
+import copy
+import os
+
+from context_packing import DEFAULT_CONTEXT_TOKENS
+from grading import GRADING_PACK_SIZE, grade_answers
+from squad_dataset import SQUAD_PATH
+
+PROVIDERS = {}
+
+
+def register_provider(provider):
+    PROVIDERS[provider.name] = provider
+    return provider
+
+
+def get_provider(name):
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown provider {name!r}; choose from {', '.join(PROVIDERS)}") from None
+
+
+class Provider:
+    """
+    Base class for providers.
+
+    Attributes:
+        name            - short name used on the command line
+        model           - model label used in reports (accuracy.RESULTS_FILES keys)
+        label           - prefix for progress messages
+        variant         - generation prompt variant (prompts.GENERATION_VARIANTS key)
+        output_path     - generated answers
+        input_path, prompt_stats_path - generation batch input and prompt statistics
+        scoring_input_path, results_path - grading batch input and results
+    """
+    name = None
+    model = None
+    label = None
+    variant = "default"
+    output_path = None
+    input_path = None
+    prompt_stats_path = None
+    scoring_input_path = None
+    results_path = None
+
+    def configure(self, model=None, variant=None, label=None, directory=None):
+        """
+        A copy of this provider answering with another `model` or prompt `variant`.
+
+        With a `directory`, every artifact of the copy is kept there under
+        `label`, so several configurations can run side by side.
+        """
+        provider = copy.copy(self)
+        provider.model = model or self.model
+        provider.variant = variant or self.variant
+        provider.label = label or self.label
+        if directory is not None:
+            for attribute, filename in (("output_path", "output.jsonl"), ("input_path", "input_batch.jsonl"),
+                                        ("prompt_stats_path", "prompt_stats.jsonl"),
+                                        ("scoring_input_path", "scoring_input_batch.jsonl"),
+                                        ("results_path", "scoring_results.jsonl")):
+                setattr(provider, attribute, os.path.join(directory, f"{provider.label}_{filename}"))
+        return provider
+
+    def generate(self, questions, retrieved, resume=True, **options):
+        """
+        Answer `questions` (dicts with "id" and "question") using the `retrieved` contexts.
+
+        With `resume`, answers already in the output file may be kept. Options a
+        provider does not use are ignored, so one set can be passed to all.
+        """
+        raise NotImplementedError
+
+    def read_answers(self):
+        """
+        An iterator over the generated answers, as dicts with "id", "question" and "response".
+        """
+        raise NotImplementedError
+
+    def grade(self, question_ids=None, local_tier=True, use_cache=True, pack_size=GRADING_PACK_SIZE,
+              squad_path=SQUAD_PATH):
+        grade_answers(
+            self.read_answers(), self.label, self.scoring_input_path, self.results_path,
+            question_ids=question_ids, local_tier=local_tier, use_cache=use_cache, pack_size=pack_size,
+            squad_path=squad_path
+        )
+
+
+class GPTProvider(Provider):
+    """
+    gpt-4o-mini answers through the OpenAI batch API.
+    """
+    name = "gpt"
+    model = "gpt-4o-mini"
+    label = "gpt4o"
+    output_path = "data/gpt4o_output.json"
+    input_path = "data/gpt4o_input_batch.jsonl"
+    prompt_stats_path = "data/gpt4o_prompt_stats.jsonl"
+    scoring_input_path = "data/gpt4o_scoring_input_batch.jsonl"
+    results_path = "data/gpt4o_scoring_results.jsonl"
+
+    def generate(self, questions, retrieved, resume=True, context_tokens=DEFAULT_CONTEXT_TOKENS,
+                 trim_context=False, use_cache=True, **options):
+        # Batch jobs resume through their tracked state, so `resume` needs no handling here
+        from gpt_with_context import gpt_4o_mini_answers
+        gpt_4o_mini_answers(questions, retrieved, output_path=self.output_path,
+                            context_tokens=context_tokens, trim_context=trim_context, use_cache=use_cache,
+                            model=self.model, variant=self.variant, input_path=self.input_path,
+                            stats_path=self.prompt_stats_path)
+
+    def read_answers(self):
+        from gpt_with_context import read_gpt_answers
+        return read_gpt_answers(self.output_path)
+
+
+class LlamaProvider(Provider):
+    """
+    Llama answers through Azure AI inference, with concurrent throttled requests.
+    """
+    name = "llama"
+    model = "llama"
+    label = "llama"
+    output_path = "data/llama_output.json"
+    prompt_stats_path = "data/llama_prompt_stats.jsonl"
+    scoring_input_path = "data/llama_scoring_inpuit_batch.jsonl"
+    results_path = "data/llama_scoring_results.jsonl"
+
+    def generate(self, questions, retrieved, resume=True, context_tokens=DEFAULT_CONTEXT_TOKENS,
+                 trim_context=False, concurrency=8, requests_per_second=10.0, use_cache=True, **options):
+        from llama_with_context import llama_answers_async
+        asyncio.run(llama_answers_async(
+            questions, retrieved, concurrency=concurrency, requests_per_second=requests_per_second,
+            output_path=self.output_path, resume=resume,
+            context_tokens=context_tokens, trim_context=trim_context, use_cache=use_cache,
+            # The endpoint's own model answers unless another one is configured
+            model=None if self.model == LlamaProvider.model else self.model,
+            variant=self.variant, stats_path=self.prompt_stats_path
+        ))
+
+    def read_answers(self):
+        from llama_with_context import read_llama_answers
+        return read_llama_answers(self.output_path)
+
+
+register_provider(GPTProvider())
+register_provider(LlamaProvider())
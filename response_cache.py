@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+
+from artifacts import JsonlReader, chunked, iter_jsonl
+from batch_manager import run_sharded_batch, write_shards
+from sqlite_cache import LRUStore
+
+RESPONSE_CACHE_PATH = "data/response_cache.sqlite"
+
+
+def response_key(provider, model, temperature, messages, options=None):
+    """
+    Content address of a chat request: a hash of (provider, model, temperature, messages).
+
+    Messages are dicts with "role" and "content"; they are serialized
+    canonically, so byte-identical prompts always map to the same key.
+    `options` holds any other request parameters that change the response
+    (response format, token cap).
+    """
+    request = {"provider": provider, "model": model, "temperature": temperature,
+               "messages": [{"role": m["role"], "content": m["content"]} for m in messages]}
+    if options:
+        request["options"] = options
+    payload = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of model responses, keyed by response_key().
+
+    Values are JSON documents (whatever the caller needs to rebuild its
+    output record). When the cache grows past `max_entries` or its values
+    past `max_bytes`, the least recently used rows are evicted (see
+    sqlite_cache.LRUStore).
+
+    Lookups are counted under `namespace`; scoped() gives each caller its
+    own counters over the same store.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=200_000, max_bytes=1 << 30, store=None,
+                 namespace=None):
+        self.path = path
+        self.store = store or LRUStore(path, "responses", max_entries, max_bytes)
+        self.namespace = namespace
+
+    def scoped(self, namespace):
+        """
+        The same cache, counting its hits and misses under `namespace`.
+        """
+        return ResponseCache(self.path, store=self.store, namespace=namespace)
+
+    def get_many(self, keys):
+        """
+        The cached values for `keys`, as a dict holding only the keys that were found.
+        """
+        return {key: json.loads(value) for key, value in self.store.get_many(keys, self.namespace).items()}
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        """
+        Store (key, value) pairs, then evict past the bounds.
+        """
+        self.store.put_many((key, json.dumps(value)) for key, value in items)
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def stats(self):
+        """
+        Return this namespace's hit/miss counters and the number of cached responses.
+        """
+        return self.store.stats(self.namespace)
+
+    def close(self):
+        self.store.close()
+
+    def print_stats(self, name="Response cache"):
+        self.store.print_stats(name, "responses", self.namespace)
+
+
+def task_key(task, provider="openai"):
+    body = task["body"]
+    options = {name: value for name, value in body.items() if name not in ("model", "temperature", "messages")}
+    return response_key(provider, body["model"], body.get("temperature"), body["messages"], options)
+
+
+def succeeded(result):
+    return (result.get("response") or {}).get("status_code") == 200
+
+
+def run_cached_batch(client, tasks, input_path, output_path, cache=None, accept=succeeded,
+                     chunk_size=500, **wait_kwargs):
+    """
+    Run batch `tasks` through the OpenAI batch API, answering repeats from `cache`.
+
+    `tasks` may be any iterable, including a generator; it is consumed once,
+    `chunk_size` tasks at a time. Cached results go straight to a plan file
+    that holds one line per task in task order. Uncached tasks get a
+    placeholder line there and are streamed to `input_path` and submitted
+    (see batch_manager.run_sharded_batch()). The plan is then merged with the
+    batch output into `output_path`, one batch output line per task, in task
+    order. Lines answered from the cache carry "from_cache": true. Results for
+    which `accept(result)` holds are added to the cache as they are merged.
+    """
+    plan_path = output_path + ".plan"
+    counts = {"tasks": 0, "cached": 0, "submitted": 0}
+
+    def misses(plan):
+        for chunk in chunked(tasks, chunk_size):
+            keys = [task_key(task) for task in chunk] if cache is not None else [None] * len(chunk)
+            cached = cache.get_many(keys) if cache is not None else {}
+            for task, key in zip(chunk, keys):
+                counts["tasks"] += 1
+                if key in cached:
+                    counts["cached"] += 1
+                    plan.write(json.dumps({"id": f"cached-{key[:16]}", "custom_id": task["custom_id"],
+                                           "response": cached[key], "error": None, "from_cache": True}) + '\n')
+                else:
+                    counts["submitted"] += 1
+                    plan.write(json.dumps({"custom_id": task["custom_id"], "pending": key}) + '\n')
+                    yield task
+
+    with open(plan_path, 'w') as plan:
+        shards = write_shards(misses(plan), input_path)
+
+    fresh = None
+    if counts["submitted"]:
+        run_sharded_batch(client, shards, output_path, **wait_kwargs)
+        fresh = JsonlReader(output_path)
+
+    try:
+        with open(output_path + ".part", 'w') as out:
+            to_cache = []
+            for slot in iter_jsonl(plan_path):
+                if "pending" not in slot:
+                    out.write(json.dumps(slot) + '\n')
+                    continue
+                result = fresh.get(slot["custom_id"])
+                if result is None:
+                    continue
+                out.write(json.dumps(result) + '\n')
+                if cache is not None and accept(result):
+                    to_cache.append((slot["pending"], result["response"]))
+                    if len(to_cache) >= chunk_size:
+                        cache.put_many(to_cache)
+                        to_cache = []
+            if cache is not None:
+                cache.put_many(to_cache)
+    finally:
+        if fresh is not None:
+            fresh.close()
+    os.replace(output_path + ".part", output_path)
+    os.remove(plan_path)
+
+    return counts
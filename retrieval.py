@@ -0,0 +1,147 @@
+import json
+import os
+import time
+
+import telemetry
+from data_preprocessing import CHROMA_PATH, COLLECTION_NAME, iter_batches
+from squad_dataset import SQUAD_PATH, load_index
+
+RETRIEVAL_HITS_PATH = "data/retrieval_hits.json"
+
+# Backend used by open_retriever() unless one is passed: "chroma", "numpy", "bm25" or "hybrid"
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "chroma")
+
+
+def open_collection(embedding_function=None, path=CHROMA_PATH, client=None):
+    """
+    Open the existing squad_contexts collection for querying.
+    """
+    if client is None:
+        import chromadb
+        client = chromadb.PersistentClient(path=path)
+    if embedding_function is None:
+        from embeddings import openai_embedding_function
+        embedding_function = openai_embedding_function()
+
+    return client.get_collection(
+        name=COLLECTION_NAME,
+        embedding_function=embedding_function
+    )
+
+
+def open_retriever(backend=None, embedding_function=None, path=None, client=None, squad_path=SQUAD_PATH):
+    """
+    Open the context store to retrieve from.
+
+    Every backend exposes a Chroma-style `query(query_texts=..., n_results=...)`
+    returning "ids", "documents" and "distances", so the result can be passed
+    to retrieve_contexts(). "chroma" opens the squad_contexts collection;
+    "numpy" opens the memory-mapped index exported by vector_index.py;
+    "bm25" opens the lexical index, which needs no embedding calls; "hybrid"
+    fuses the Chroma and BM25 rankings. The BM25 index is built from the
+    SQuAD file at `squad_path`.
+    """
+    backend = backend or RETRIEVER_BACKEND
+    if backend == "bm25":
+        from bm25 import load_bm25
+        return load_bm25(squad_path)
+
+    if embedding_function is None:
+        from embeddings import openai_embedding_function
+        embedding_function = openai_embedding_function()
+
+    if backend == "chroma":
+        return open_collection(embedding_function=embedding_function, path=path or CHROMA_PATH, client=client)
+    if backend == "numpy":
+        from vector_index import VECTOR_INDEX_PATH, VectorIndex
+        return VectorIndex(path or VECTOR_INDEX_PATH, embedding_function=embedding_function)
+    if backend == "hybrid":
+        from bm25 import HybridRetriever, load_bm25
+        dense = open_collection(embedding_function=embedding_function, path=path or CHROMA_PATH, client=client)
+        return HybridRetriever(dense, load_bm25(squad_path))
+    raise ValueError(f"Unknown retriever backend: {backend}")
+
+
+def retrieve_results(collection, questions, n_results=5, batch_size=64):
+    """
+    Retrieve the top `n_results` chunks for every question, keeping their ids and distances.
+
+    `collection` is a Chroma collection or any retriever from open_retriever().
+    Questions are deduplicated and sent `batch_size` at a time, so each batch
+    costs one embedding request and one multi-query search instead of one of
+    each per question. The latency of every batch query is recorded as a
+    "retrieve" request.
+
+    Returns a dict mapping each question to a dict of "ids", "documents" and
+    "distances" lists, best match first.
+    """
+    unique_questions = list(dict.fromkeys(questions))
+    results = {}
+
+    for batch in iter_batches(unique_questions, batch_size):
+        start = time.perf_counter()
+        batch_results = collection.query(query_texts=batch, n_results=n_results)
+        telemetry.record_request("retrieve", None, latency=time.perf_counter() - start, queries=len(batch))
+        for i, question in enumerate(batch):
+            results[question] = {
+                "ids": batch_results["ids"][i],
+                "documents": batch_results["documents"][i],
+                "distances": batch_results["distances"][i],
+            }
+
+        print(f"Retrieved contexts for {len(results)} / {len(unique_questions)} questions")
+
+    return results
+
+
+def retrieve_contexts(collection, questions, n_results=5, batch_size=64):
+    """
+    Retrieve the top `n_results` context chunks for every question; see retrieve_results().
+
+    Returns a dict mapping each question to its list of context chunks.
+    """
+    results = retrieve_results(collection, questions, n_results, batch_size)
+    return {question: result["documents"] for question, result in results.items()}
+
+
+def retrieve_for_questions(collection, questions, n_results=5, embedding_function=None):
+    """
+    Retrieve contexts for question dicts ("id", "question") and record which found their gold paragraph.
+
+    Returns the mapping from retrieve_contexts().
+    """
+    retrieved = retrieve_contexts(collection, [q["question"] for q in questions], n_results=n_results)
+    if hasattr(embedding_function, "print_stats"):
+        embedding_function.print_stats()
+    record_retrieval_hits(questions, retrieved)
+    return retrieved
+
+
+def record_retrieval_hits(questions, retrieved, path=RETRIEVAL_HITS_PATH, squad_path=SQUAD_PATH):
+    """
+    Record, per question id, whether the gold paragraph was among the retrieved chunks.
+
+    `questions` are dicts with "id" and "question" keys and `retrieved` is the
+    mapping returned by retrieve_contexts(). Entries are merged into the JSON
+    file at `path`, which accuracy.py uses to split accuracy by retrieval hit.
+    Gold paragraphs are looked up in the SQuAD file at `squad_path`.
+    """
+    index = load_index(squad_path)
+    hits = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            hits = json.load(f)
+
+    for item in questions:
+        pos = index.position(item["id"])
+        if pos is not None and item["question"] in retrieved:
+            hits[item["id"]] = index.contexts[index.paragraph[pos]] in retrieved[item["question"]]
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(hits, f)
+    os.replace(tmp_path, path)
+
+    found = sum(hits[item["id"]] for item in questions if item["id"] in hits)
+    print(f"Gold paragraph retrieved for {found} / {len(questions)} questions")
+    return hits
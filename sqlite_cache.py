@@ -0,0 +1,136 @@
+"""
+A persistent key-value store in SQLite with least-recently-used eviction.
+
+Shared by the embedding cache and the response cache: each keeps its own
+file and table, and decides how its values are encoded.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+# Keys per "IN (...)" lookup, below SQLite's bound variable limit
+LOOKUP_CHUNK = 500
+
+
+class LRUStore:
+    """
+    A table of (key, value, size, last_used) rows in the SQLite file at `path`.
+
+    Values are stored as given (str or bytes). Every lookup refreshes the
+    last_used time of the keys it finds; when the table grows past
+    `max_entries` rows or its values past `max_bytes` (if set), the least
+    recently used rows are evicted. Hit and miss counters cover this process
+    and are kept per `namespace`, so callers sharing one store (several
+    configurations generating at once, say) each report their own lookups.
+    """
+
+    def __init__(self, path, table, max_entries, max_bytes=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # namespace -> [hits, misses]
+        self.counters = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+        self._conn.commit()
+
+    def execute(self, sql, parameters=()):
+        """
+        Run one statement on the store's connection and commit; for schema migrations.
+        """
+        with self._lock:
+            rows = self._conn.execute(sql, parameters).fetchall()
+            self._conn.commit()
+        return rows
+
+    def get_many(self, keys, namespace=None):
+        """
+        The stored values for `keys`, as a dict holding only the keys that were found.
+
+        The hits and misses are counted under `namespace`.
+        """
+        now = time.time()
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique_keys), LOOKUP_CHUNK):
+                chunk = unique_keys[start:start + LOOKUP_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update(rows)
+
+            self._conn.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?",
+                                   [(now, key) for key in found])
+            self._conn.commit()
+            counters = self.counters.setdefault(namespace, [0, 0])
+            counters[0] += sum(1 for key in keys if key in found)
+            counters[1] += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """
+        Store (key, value) pairs, then evict past the bounds.
+        """
+        now = time.time()
+        rows = [(key, value, len(value), now) for key, value in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, size, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, size = self._conn.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        max_bytes = self.max_bytes if self.max_bytes is not None else size
+        if count <= self.max_entries and size <= max_bytes:
+            return
+        # Drop the oldest rows until both bounds hold again
+        excess_rows = max(0, count - self.max_entries)
+        excess_bytes = max(0, size - max_bytes)
+        removed_rows = removed_bytes = 0
+        stale = []
+        for key, row_size in self._conn.execute(f"SELECT key, size FROM {self.table} ORDER BY last_used"):
+            if removed_rows >= excess_rows and removed_bytes >= excess_bytes:
+                break
+            stale.append((key,))
+            removed_rows += 1
+            removed_bytes += row_size
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", stale)
+
+    def stats(self, namespace=None):
+        """
+        Return the hit/miss counters of `namespace` in this process and the number of stored rows.
+        """
+        with self._lock:
+            (size,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+            hits, misses = self.counters.get(namespace, (0, 0))
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "size": size,
+        }
+
+    def print_stats(self, name, unit="rows", namespace=None):
+        stats = self.stats(namespace)
+        print(f"{name}: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} hit rate, {stats['size']} {unit} stored)")
+
+    def close(self):
+        self._conn.close()
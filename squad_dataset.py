@@ -0,0 +1,182 @@
+import json
+import os
+import pickle
+from array import array
+
+from artifacts import file_sha256
+
+SQUAD_PATH = "data/dev-v2.0.json"
+
+# Bump when the index layout changes so stale pickles are rebuilt
+INDEX_VERSION = 1
+
+# Indexes already loaded in this process, by source path
+_loaded = {}
+
+
+class SquadIndex:
+    """
+    Compact columnar index over a SQuAD file.
+
+    Question columns (one entry per question, in file order):
+        ids, questions, answers (tuple of every distinct gold answer text),
+        is_impossible (array of 0/1), paragraph (array of paragraph positions)
+    Paragraph columns (one entry per paragraph):
+        contexts, article (array of article positions)
+    Article columns:
+        titles
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.questions = []
+        self.answers = []
+        self.is_impossible = array('b')
+        self.paragraph = array('i')
+        self.contexts = []
+        self.article = array('i')
+        self.titles = []
+        self._positions = None
+
+    @classmethod
+    def from_squad(cls, data):
+        index = cls()
+        for article in data["data"]:
+            index.titles.append(article.get("title", ""))
+            for paragraph in article["paragraphs"]:
+                index.contexts.append(paragraph["context"])
+                index.article.append(len(index.titles) - 1)
+                for qa in paragraph["qas"]:
+                    index.ids.append(qa["id"])
+                    index.questions.append(qa["question"])
+                    index.answers.append(tuple(dict.fromkeys(a["text"] for a in qa["answers"])))
+                    index.is_impossible.append(1 if qa.get("is_impossible") else 0)
+                    index.paragraph.append(len(index.contexts) - 1)
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_positions"] = None
+        return state
+
+    def position(self, question_id):
+        """
+        Position of a question id in the question columns, or None if unknown.
+        """
+        if self._positions is None:
+            self._positions = {qid: pos for pos, qid in enumerate(self.ids)}
+        return self._positions.get(question_id)
+
+    def record(self, pos):
+        """
+        All fields for the question at `pos` as a dict.
+        """
+        paragraph = self.paragraph[pos]
+        return {
+            "id": self.ids[pos],
+            "question": self.questions[pos],
+            "answers": list(self.answers[pos]),
+            "is_impossible": bool(self.is_impossible[pos]),
+            "paragraph": paragraph,
+            "context": self.contexts[paragraph],
+            "title": self.titles[self.article[paragraph]],
+        }
+
+    def select(self, answerable_only=True, titles=None, start=0, limit=None):
+        """
+        Positions of the questions matching the filters, in file order.
+
+        `start` and `limit` slice the filtered sequence, so
+        `select(limit=500)` is the first 500 answerable questions.
+        """
+        title_filter = set(titles) if titles is not None else None
+        positions = []
+        skipped = 0
+        for pos in range(len(self.ids)):
+            if answerable_only and self.is_impossible[pos]:
+                continue
+            if title_filter is not None and self.titles[self.article[self.paragraph[pos]]] not in title_filter:
+                continue
+            if skipped < start:
+                skipped += 1
+                continue
+            if limit is not None and len(positions) >= limit:
+                break
+            positions.append(pos)
+        return positions
+
+    def iter_questions(self, answerable_only=True, titles=None, start=0, limit=None):
+        """
+        Yield question records matching the filters; see `select()` and `record()`.
+        """
+        for pos in self.select(answerable_only, titles, start, limit):
+            yield self.record(pos)
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_index(path=SQUAD_PATH, cache_path=None):
+    """
+    Load the SquadIndex for `path`, parsing the JSON only when necessary.
+
+    The index is pickled to `cache_path` (default `<path>.index.pickle`). The
+    pickle is reused while the source file's size and mtime are unchanged;
+    if they changed, the file is re-hashed and the pickle is still reused when
+    the content hash matches. Otherwise the JSON is parsed again and the pickle
+    rewritten. Within one process the loaded index is memoized.
+    """
+    cache_path = cache_path or path + ".index.pickle"
+    fingerprint = file_fingerprint(path)
+
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                header = pickle.load(f)
+                if header.get("version") == INDEX_VERSION:
+                    if header["fingerprint"] == fingerprint:
+                        index = pickle.load(f)
+                        _loaded[path] = (fingerprint, index)
+                        return index
+                    if header["sha256"] == file_sha256(path):
+                        index = pickle.load(f)
+                        _save(cache_path, fingerprint, header["sha256"], index)
+                        _loaded[path] = (fingerprint, index)
+                        return index
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError, AttributeError):
+            pass
+
+    with open(path, 'r', encoding="utf-8") as f:
+        index = SquadIndex.from_squad(json.load(f))
+
+    _save(cache_path, fingerprint, file_sha256(path), index)
+    _loaded[path] = (fingerprint, index)
+    return index
+
+
+def possible_questions(limit=500, path=SQUAD_PATH):
+    """
+    The first `limit` answerable questions in the dataset, with their SQuAD ids.
+    """
+    return [
+        {"id": qa["id"], "question": qa["question"]}
+        for qa in load_index(path).iter_questions(answerable_only=True, limit=limit)
+    ]
+
+
+def _save(cache_path, fingerprint, sha256, index):
+    # The small header is pickled first so validity can be checked without loading the index
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({"version": INDEX_VERSION, "fingerprint": fingerprint, "sha256": sha256}, f)
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
@@ -0,0 +1,311 @@
+"""
+Local stand-in for the chat completions and embeddings endpoints and the OpenAI files/batches
+endpoints, for exercising the clients without touching the real services.
+
+Every chat completion sleeps for a random artificial latency, and a
+configurable fraction of requests fail with 429 or 503 so retry handling
+gets exercised. Batch jobs move through validating -> in_progress ->
+completed over successive status checks, answering every input line with a
+stub chat completion; embeddings are hashed bags of words, so similar texts
+land close together; --batch-status can force a job to end as failed or
+expired instead. Requests with a JSON schema response format get a
+{"score": ...} verdict, a --malformed-rate fraction of them cut off mid-JSON.
+
+Run it, then point the scripts at it:
+    python stub_server.py --port 8008 --latency-ms 300 --error-rate 0.05
+    AZURE_MLSTUDIO_ENDPOINT=http://127.0.0.1:8008 AZURE_MLSTUDIO_KEY=stub python llama_with_context.py --async
+    OPENAI_BASE_URL=http://127.0.0.1:8008/v1 OPENAI_API_KEY=stub python gpt_scoring.py
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import math
+import struct
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.3
+    jitter = 0.5
+    error_rate = 0.0
+    malformed_rate = 0.0
+    batch_polls = 3
+    batch_status = "completed"
+    stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+    files = {}
+    batches = {}
+    ids = itertools.count(1)
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-stub{next(self.ids)}"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        parts = path.strip("/").split("/")
+
+        if len(parts) == 3 and parts[:2] == ["v1", "batches"] and parts[2] in self.batches:
+            self._send_json(200, self._advance_batch(self.batches[parts[2]]))
+        elif len(parts) == 4 and parts[:2] == ["v1", "files"] and parts[3] == "content" and parts[2] in self.files:
+            content = self.files[parts[2]]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        path = self.path.split("?")[0]
+
+        if path == "/v1/files":
+            self._send_json(200, self._create_file(raw))
+            return
+        if path == "/v1/batches":
+            self._send_json(200, self._create_batch(json.loads(raw)))
+            return
+
+        request = json.loads(raw or b"{}")
+        if path.endswith("/embeddings"):
+            self._send_json(200, embedding_response(request))
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+            if random.random() < self.error_rate:
+                with self.lock:
+                    self.stats["errors"] += 1
+                status = random.choice([429, 503])
+                self._send_json(status, {"error": {"code": str(status), "message": "stub failure"}},
+                                headers={"Retry-After": "0.1"} if status == 429 else None)
+                return
+
+            self._send_json(200, chat_completion(request, self.malformed_rate))
+        finally:
+            with self.lock:
+                self.stats["in_flight"] -= 1
+
+
+    def _create_file(self, raw):
+        # Parse the multipart upload by prefixing the request's own content type header
+        message = BytesParser().parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + raw
+        )
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+        upload = fields["file"]
+        file_id = self._new_id("file")
+        self.files[file_id] = {
+            "content": upload.get_payload(decode=True),
+            "filename": upload.get_filename() or "upload.jsonl",
+            "purpose": fields["purpose"].get_payload(decode=True).decode("utf-8") if "purpose" in fields else "batch",
+        }
+        return self._file_object(file_id)
+
+    def _file_object(self, file_id):
+        stored = self.files[file_id]
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(stored["content"]),
+            "created_at": int(time.time()),
+            "filename": stored["filename"],
+            "purpose": stored["purpose"],
+            "status": "processed",
+        }
+
+    def _create_batch(self, request):
+        lines = [line for line in self.files[request["input_file_id"]]["content"].splitlines() if line.strip()]
+        batch_id = self._new_id("batch")
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "input_file_id": request["input_file_id"],
+            "completion_window": request["completion_window"],
+            "status": "validating",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "polls": 0,
+        }
+        return self._batch_object(self.batches[batch_id])
+
+    def _advance_batch(self, batch):
+        with self.lock:
+            batch["polls"] += 1
+            if batch["status"] in ("validating", "in_progress"):
+                if batch["polls"] < self.batch_polls:
+                    batch["status"] = "in_progress"
+                elif self.batch_status == "completed":
+                    self._complete_batch(batch)
+                else:
+                    batch["status"] = self.batch_status
+                    if self.batch_status == "failed":
+                        batch["errors"] = {"object": "list", "data": [
+                            {"code": "invalid_request", "message": "stub validation failure", "line": 1}
+                        ]}
+        return self._batch_object(batch)
+
+    def _complete_batch(self, batch):
+        output = []
+        for line in self.files[batch["input_file_id"]]["content"].splitlines():
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            output.append(json.dumps({
+                "id": f"batch_req_{random.getrandbits(48):012x}",
+                "custom_id": task["custom_id"],
+                "response": {"status_code": 200, "request_id": "stub", "body": chat_completion(task["body"], self.malformed_rate)},
+                "error": None,
+            }))
+        file_id = f"file-stub-output-{batch['id']}"
+        self.files[file_id] = {
+            "content": ("\n".join(output) + "\n").encode("utf-8"),
+            "filename": "batch_output.jsonl",
+            "purpose": "batch_output",
+        }
+        batch["output_file_id"] = file_id
+        batch["status"] = "completed"
+        batch["request_counts"]["completed"] = len(output)
+
+    def _batch_object(self, batch):
+        return {key: value for key, value in batch.items() if key != "polls"}
+
+
+def chat_completion(request, malformed_rate=0.0):
+    """
+    Build a chat completion response echoing the tail of the last user message.
+
+    Structured output requests are answered with a random boolean score
+    instead, or with truncated JSON for a `malformed_rate` fraction of them.
+    """
+    messages = request.get("messages", [])
+    prompt = " ".join(str(m.get("content", "")) for m in messages)
+    question = prompt.rsplit("Here is the question:", 1)[-1].split("\n")[0].strip()
+    content = f"Stub answer to: {question}"
+    finish_reason = "stop"
+    response_format = request.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        content = json.dumps({"score": random.random() < 0.8})
+        if response_format["json_schema"].get("name") == "grades":
+            # Packed grading: one verdict per "ID: <id>" item in the prompt
+            ids = re.findall(r"^ID: (\S+)$", str(messages[-1].get("content", "")), re.M)
+            content = json.dumps({"grades": [{"id": item_id, "score": random.random() < 0.8} for item_id in ids]})
+        if random.random() < malformed_rate:
+            content, finish_reason = content[:7], "length"
+    prompt_tokens = len(prompt.split())
+    completion_tokens = len(content.split())
+
+    return {
+        "id": f"stub-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model") or "stub-llama",
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason,
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def embedding_response(request, dim=64):
+    """
+    Build an embeddings response with a normalized hashed bag-of-words vector per input text.
+    """
+    texts = request.get("input") or []
+    if isinstance(texts, str):
+        texts = [texts]
+    data = []
+    for index, text in enumerate(texts):
+        vector = [0.0] * dim
+        for word in re.findall(r"\w+", str(text).lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % dim] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        vector = [v / norm for v in vector]
+        if request.get("encoding_format") == "base64":
+            vector = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii")
+        data.append({"object": "embedding", "index": index, "embedding": vector})
+    tokens = sum(len(str(text).split()) for text in texts)
+    return {"object": "list", "data": data, "model": request.get("model") or "stub-embedding",
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+def serve(port=8008, latency=0.3, jitter=0.5, error_rate=0.0, batch_polls=3, batch_status="completed",
+          malformed_rate=0.0):
+    """
+    Start the stub server on a background thread and return it.
+    """
+    StubHandler.latency = latency
+    StubHandler.jitter = jitter
+    StubHandler.error_rate = error_rate
+    StubHandler.malformed_rate = malformed_rate
+    StubHandler.batch_polls = batch_polls
+    StubHandler.batch_status = batch_status
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake chat completions endpoint with artificial latency.")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="mean response latency")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429/503")
+    parser.add_argument("--batch-polls", type=int, default=3, help="status checks before a batch job finishes")
+    parser.add_argument("--batch-status", default="completed", choices=["completed", "failed", "expired", "cancelled"],
+                        help="terminal status batch jobs end in")
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="fraction of structured output responses cut off mid-JSON")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency_ms / 1000, args.jitter, args.error_rate,
+                   args.batch_polls, args.batch_status, args.malformed_rate)
+    print(f"Stub endpoints listening on http://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"Stats: {StubHandler.stats}, {len(StubHandler.batches)} batch jobs")
+    except KeyboardInterrupt:
+        server.shutdown()
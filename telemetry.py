@@ -0,0 +1,221 @@
+"""
+Run telemetry: per-request latency, tokens and cost, aggregated per stage.
+
+Instrumented code calls record_request() for every model or index request
+and wraps coarser steps (batch waits, pipeline stages) in timed(). Every
+event is appended as one JSON line to the metrics file, tagged with the run
+id, so a run's events can be summarized afterwards with summarize().
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from prompts import usage_tokens
+
+METRICS_PATH = "data/metrics.jsonl"
+
+# USD per million tokens: (input, cached input, output)
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "llama": (0.30, 0.30, 0.61),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+}
+# Batch API requests are billed at half the synchronous price
+BATCH_DISCOUNT = 0.5
+
+_lock = threading.Lock()
+_run_id = None
+
+
+def run_id():
+    """
+    The id that tags this run's events: $RUN_ID if set, otherwise one generated per process.
+    """
+    global _run_id
+    if _run_id is None:
+        _run_id = os.environ.get("RUN_ID") or time.strftime("%Y%m%dT%H%M%S-") + uuid.uuid4().hex[:6]
+    return _run_id
+
+
+def model_prices(model):
+    # Dated snapshots ("gpt-4o-mini-2024-07-18") are priced like their base model
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.lower().startswith(name):
+            return PRICES[name]
+    return None
+
+
+def cost(model, prompt_tokens, completion_tokens, cached_tokens=0, batch=False):
+    """
+    USD cost of one request, or None when `model` has no known price.
+
+    Requests that are not model calls (model None) cost nothing.
+    """
+    if model is None:
+        return 0.0
+    prices = model_prices(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    usd = ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+           + completion_tokens * output_price) / 1_000_000
+    return usd * BATCH_DISCOUNT if batch else usd
+
+
+def usage_counts(usage):
+    """
+    (prompt_tokens, cached_tokens, completion_tokens) from a response's usage, as a dict or SDK object.
+    """
+    prompt_tokens, cached_tokens = usage_tokens(usage)
+    if usage and not isinstance(usage, dict):
+        usage = usage.as_dict() if hasattr(usage, "as_dict") else vars(usage)
+    return prompt_tokens, cached_tokens, (usage or {}).get("completion_tokens") or 0
+
+
+def event(kind, stage, **fields):
+    return {"run": run_id(), "time": round(time.time(), 3), "kind": kind, "stage": stage, **fields}
+
+
+def request_event(stage, model, usage=None, latency=None, batch=False, **fields):
+    prompt_tokens, cached_tokens, completion_tokens = usage_counts(usage)
+    return event(
+        "request", stage, model=model,
+        latency=round(latency, 4) if latency is not None else None,
+        prompt_tokens=prompt_tokens, cached_tokens=cached_tokens, completion_tokens=completion_tokens,
+        cost=cost(model, prompt_tokens, completion_tokens, cached_tokens, batch), batch=batch, **fields
+    )
+
+
+def write_events(events, path=METRICS_PATH):
+    """
+    Append events (any iterable) to the metrics file.
+    """
+    directory = os.path.dirname(path)
+    with _lock:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            for item in events:
+                f.write(json.dumps(item) + '\n')
+
+
+def record_request(stage, model, usage=None, latency=None, batch=False, path=METRICS_PATH, **fields):
+    """
+    Record one request of `stage`: its latency in seconds, token usage and cost.
+    """
+    write_events([request_event(stage, model, usage, latency, batch, **fields)], path)
+
+
+def record_batch_results(stage, rows, path=METRICS_PATH):
+    """
+    Record the requests behind batch output lines.
+
+    Batch requests have no individual latency (see the "batch_wait" stage).
+    Rows answered from the response cache or graded locally cost nothing and
+    are skipped. `rows` may be any iterable; it is streamed.
+    """
+    def events():
+        for row in rows:
+            body = (row.get("response") or {}).get("body") or {}
+            if row.get("from_cache") or not body.get("usage"):
+                continue
+            yield request_event(stage, body.get("model"), body["usage"], batch=True)
+    write_events(events(), path)
+
+
+@contextmanager
+def timed(stage, path=METRICS_PATH, **fields):
+    """
+    Record the wall time of the enclosed block as a `stage` event.
+    """
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        write_events([event("stage", stage, seconds=round(time.perf_counter() - start, 4), ok=ok, **fields)], path)
+
+
+def read_events(path=METRICS_PATH, run=None):
+    """
+    The events in the metrics file for `run`: the latest run by default, or every run with "all".
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if run is None and events:
+        run = events[-1]["run"]
+    return [item for item in events if run == "all" or item["run"] == run]
+
+
+def summarize(events):
+    """
+    Aggregate events per stage: request count, p50/p95 request latency, wall time, tokens and cost.
+
+    Requests of models without a known price are counted as "unpriced".
+    """
+    import numpy as np
+
+    stages = {}
+    latencies = {}
+    for item in events:
+        stage = stages.setdefault(item["stage"], {
+            "requests": 0, "latency_p50": None, "latency_p95": None, "timed_runs": 0, "seconds": 0.0,
+            "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost": 0.0, "unpriced": 0,
+        })
+        if item["kind"] == "stage":
+            stage["timed_runs"] += 1
+            stage["seconds"] += item["seconds"]
+            continue
+
+        stage["requests"] += 1
+        for field in ("prompt_tokens", "cached_tokens", "completion_tokens"):
+            stage[field] += item[field]
+        if item["cost"] is None:
+            stage["unpriced"] += 1
+        else:
+            stage["cost"] += item["cost"]
+        if item["latency"] is not None:
+            latencies.setdefault(item["stage"], []).append(item["latency"])
+
+    for name, stage in stages.items():
+        if latencies.get(name):
+            p50, p95 = np.percentile(latencies[name], [50, 95])
+            stage["latency_p50"], stage["latency_p95"] = round(float(p50), 4), round(float(p95), 4)
+        stage["seconds"] = round(stage["seconds"], 3)
+        stage["cost"] = round(stage["cost"], 6)
+
+    total = {field: sum(stage[field] for stage in stages.values())
+             for field in ("requests", "prompt_tokens", "cached_tokens", "completion_tokens", "unpriced")}
+    total["cost"] = round(sum(stage["cost"] for stage in stages.values()), 6)
+    runs = sorted({item["run"] for item in events})
+    return {"runs": runs, "stages": stages, "total": total}
+
+
+def print_summary(summary):
+    """
+    Print the per-stage telemetry table of summarize().
+    """
+    if not summary["stages"]:
+        print("No telemetry recorded")
+        return
+
+    print(f"Telemetry for run {', '.join(summary['runs'])}:")
+    print(f"  {'stage':<16} {'requests':>8} {'p50 s':>8} {'p95 s':>8} {'wall s':>9} "
+          f"{'prompt tok':>11} {'cached':>9} {'output tok':>10} {'cost $':>10}")
+    for name, stage in summary["stages"].items():
+        p50 = f"{stage['latency_p50']:.3f}" if stage["latency_p50"] is not None else "-"
+        p95 = f"{stage['latency_p95']:.3f}" if stage["latency_p95"] is not None else "-"
+        wall = f"{stage['seconds']:.1f}" if stage["timed_runs"] else "-"
+        print(f"  {name:<16} {stage['requests']:>8} {p50:>8} {p95:>8} {wall:>9} {stage['prompt_tokens']:>11} "
+              f"{stage['cached_tokens']:>9} {stage['completion_tokens']:>10} {stage['cost']:>10.4f}")
+    total = summary["total"]
+    print(f"  {'total':<16} {total['requests']:>8} {'':>8} {'':>8} {'':>9} {total['prompt_tokens']:>11} "
+          f"{total['cached_tokens']:>9} {total['completion_tokens']:>10} {total['cost']:>10.4f}")
+    if total["unpriced"]:
+        print(f"  {total['unpriced']} requests of models without a known price are not in the cost")
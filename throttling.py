@@ -0,0 +1,76 @@
+import asyncio
+import random
+import time
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Async token bucket limiting how many requests start per second.
+
+    Tokens refill continuously at `rate` per second up to `capacity`, and each
+    call to `acquire()` waits until a token is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def is_retryable(error):
+    """
+    Return True if an Azure SDK error is a rate limit, a 5xx, or a connection failure.
+    """
+    from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+    if isinstance(error, HttpResponseError) and error.status_code is not None:
+        return error.status_code in RETRYABLE_STATUSES
+    return isinstance(error, (ServiceRequestError, ServiceResponseError))
+
+
+def retry_after(error):
+    """
+    Seconds the server asked us to wait, if it sent a Retry-After header.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def call_with_retry(make_call, max_retries=5, base_delay=1.0, max_delay=30.0):
+    """
+    Await `make_call()` and retry retryable errors with full-jitter exponential backoff.
+
+    A Retry-After header from the server takes precedence over the computed delay.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await make_call()
+        except Exception as error:
+            if attempt == max_retries or not is_retryable(error):
+                raise
+            delay = retry_after(error)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Retrying after error ({error.__class__.__name__}), waiting {delay:.1f}s")
+            await asyncio.sleep(delay)
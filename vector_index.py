@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+VECTOR_INDEX_PATH = "data/vector_index"
+INDEX_VERSION = 1
+
+
+def normalize(vectors):
+    """
+    Unit-normalize rows as float32, so a dot product is the cosine similarity.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """
+    Column indices of the `k` highest scores in each row, best first.
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def kmeans(vectors, n_lists, iterations=10, sample_size=50_000, seed=0):
+    """
+    Spherical k-means centroids for the IVF lists, trained on a sample of the vectors.
+
+    There are at most as many lists as sampled vectors, so fewer than `n_lists` centroids may be returned.
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), sample_size), replace=False)]
+    n_lists = min(n_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = sample[assignment == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Exact or IVF cosine search over embeddings in a memory-mapped .npy file.
+
+    An index directory holds:
+        embeddings.npy   - unit-normalized float32 vectors, one row per document
+        documents.json   - the ids and texts of the rows, in the same order
+        meta.json        - format version, embedding model and IVF layout
+        centroids.npy    - IVF list centroids (IVF indexes only)
+
+    In an IVF index the rows are stored grouped by list, so each list is a
+    contiguous slice of the memory map and a query only reads the `n_probe`
+    lists nearest to it. Without IVF every query is scored against all rows
+    with one matrix product per block of rows.
+
+    `query()` takes and returns the same shapes as a Chroma collection's, so
+    the index can be passed anywhere a collection is queried, such as
+    retrieval.retrieve_contexts(). Distances are cosine distances (1 - cosine).
+    """
+
+    def __init__(self, path=VECTOR_INDEX_PATH, embedding_function=None, n_probe=8, block_size=65_536):
+        self.path = path
+        self.embedding_function = embedding_function
+        self.n_probe = n_probe
+        self.block_size = block_size
+
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path} was built by an incompatible version; rebuild it")
+
+        with open(os.path.join(path, "documents.json")) as f:
+            documents = json.load(f)
+        self.ids = documents["ids"]
+        self.documents = documents["documents"]
+
+        self.embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+        self.offsets = np.asarray(self.meta.get("offsets") or [0, len(self.ids)], dtype=np.int64)
+        centroids_path = os.path.join(path, "centroids.npy")
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+
+    def count(self):
+        return len(self.ids)
+
+    @staticmethod
+    def build(path, ids, documents, embeddings, n_lists=0, model=None):
+        """
+        Write an index directory from parallel lists of ids, documents and embeddings.
+
+        With `n_lists` > 0 the vectors are partitioned into that many IVF lists,
+        or one list per vector when there are fewer vectors than lists.
+        """
+        vectors = normalize(embeddings)
+        offsets = None
+        centroids = None
+        if n_lists and len(vectors):
+            centroids = kmeans(vectors, n_lists)
+            n_lists = len(centroids)
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind="stable")
+            vectors = vectors[order]
+            ids = [ids[i] for i in order]
+            documents = [documents[i] for i in order]
+            offsets = np.searchsorted(assignment[order], np.arange(n_lists + 1)).tolist()
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "embeddings.npy"), vectors)
+        centroids_path = os.path.join(path, "centroids.npy")
+        if centroids is not None:
+            np.save(centroids_path, centroids)
+        elif os.path.exists(centroids_path):
+            os.remove(centroids_path)
+        with open(os.path.join(path, "documents.json"), 'w') as f:
+            json.dump({"ids": list(ids), "documents": list(documents)}, f)
+        with open(os.path.join(path, "meta.json"), 'w') as f:
+            json.dump({
+                "version": INDEX_VERSION,
+                "model": model,
+                "count": len(vectors),
+                "dim": int(vectors.shape[1]) if len(vectors) else 0,
+                "n_lists": n_lists,
+                "offsets": offsets,
+            }, f)
+
+    def _search_flat(self, queries, n_results):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self.ids), self.block_size):
+            block = np.asarray(self.embeddings[start:start + self.block_size])
+            scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+            rows = np.concatenate([best_rows, np.broadcast_to(
+                np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+            keep = top_k(scores, n_results)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+        return best_rows, best_scores
+
+    def _search_ivf(self, queries, n_results):
+        probes = top_k(queries @ self.centroids.T, self.n_probe)
+        rows_out = []
+        scores_out = []
+        for query, lists in zip(queries, probes):
+            # Each list is a contiguous run of rows, so it is read as one slice of the memory map
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+            vectors = np.concatenate([self.embeddings[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+            scores = vectors @ query
+            keep = top_k(scores[None, :], n_results)[0]
+            rows_out.append(rows[keep])
+            scores_out.append(scores[keep])
+        return rows_out, scores_out
+
+    def query(self, query_texts=None, query_embeddings=None, n_results=10, include=None):
+        """
+        Find the `n_results` nearest documents to each query text or embedding.
+
+        Returns a dict with "ids", "documents" and "distances", each a list with
+        one inner list per query, like chromadb's Collection.query().
+        """
+        if query_embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("query_texts needs an embedding_function")
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = normalize(query_embeddings)
+
+        if self.centroids is not None:
+            rows, scores = self._search_ivf(queries, n_results)
+        else:
+            rows, scores = self._search_flat(queries, n_results)
+
+        return {
+            "ids": [[self.ids[i] for i in r] for r in rows],
+            "documents": [[self.documents[i] for i in r] for r in rows],
+            "distances": [[float(1 - s) for s in row_scores] for row_scores in scores],
+        }
+
+
+def export_from_chroma(collection, path=VECTOR_INDEX_PATH, n_lists=0, batch_size=5_000):
+    """
+    Copy the stored embeddings and documents of a Chroma collection into a VectorIndex.
+
+    Nothing is re-embedded: the vectors are read from the collection page by
+    page. Returns the number of documents exported.
+    """
+    ids = []
+    documents = []
+    embeddings = []
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        page = collection.get(include=["embeddings", "documents"], limit=batch_size, offset=offset)
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        embeddings.extend(np.asarray(page["embeddings"], dtype=np.float32))
+        print(f"Exported {len(ids)} / {total} embeddings")
+
+    ef = getattr(collection, "_embedding_function", None)
+    model = ef.name() if ef is not None and hasattr(ef, "name") else None
+    VectorIndex.build(path, ids, documents, np.array(embeddings).reshape(len(ids), -1), n_lists=n_lists, model=model)
+    return len(ids)
+
+
+if __name__ == "__main__":
+    from retrieval import open_collection
+
+    parser = argparse.ArgumentParser(description="Export the Chroma collection to a memory-mapped vector index.")
+    parser.add_argument("--output", default=VECTOR_INDEX_PATH, help="index directory to write")
+    parser.add_argument("--ivf-lists", type=int, default=0,
+                        help="partition the vectors into this many IVF lists (0 for exact search)")
+    args = parser.parse_args()
+
+    count = export_from_chroma(open_collection(), args.output, n_lists=args.ivf_lists)
+    print(f"Wrote {count} vectors to {args.output}")